@@ -1,14 +1,28 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context, send_from_directory
 from functools import wraps
+import click
 from datetime import datetime
 import db_helper
+import attendance_queue
+import attendance_events
+import photo_jobs
+import static_assets
+import passwords
+import scan_guard
+import hmac
 import re
 import os
-import base64
-from werkzeug.utils import secure_filename
+import csv
+import io
+import json
+import mimetypes
+import zipfile
+import zlib
 
 app = Flask(__name__)
-app.secret_key = 'your-secret-key-change-this-in-production'
+# Sessions are signed with SECRET_KEY. Without it a random key is made,
+# which signs everyone out on restart (wsgi.py refuses to start without it)
+app.secret_key = os.environ.get('SECRET_KEY') or os.urandom(32)
 
 # Configure upload folder
 UPLOAD_FOLDER = 'static/images'
@@ -21,6 +35,69 @@ if not os.path.exists(UPLOAD_FOLDER):
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
+# Acknowledge scans once queued and let a background writer group-commit them
+app.config['ATTENDANCE_WRITE_BEHIND'] = False
+
+# Scanner kiosks opened once with /scan?kiosk=<KIOSK_TOKEN> may download
+# the roster for offline validation; unset, only signed-in users can
+app.config['KIOSK_TOKEN'] = os.environ.get('KIOSK_TOKEN')
+
+# Hand each request's database connection back to the pool
+app.teardown_appcontext(db_helper.release_connection)
+
+# Importing the app never migrates: wsgi.py, `python app.py` and
+# `flask migrate` do, before serving. Until then requests are refused.
+_schema_current = False
+
+
+@app.before_request
+def require_current_schema():
+    """Answer 503 while the database is behind the code's schema (static files still load)"""
+    global _schema_current
+    if _schema_current or request.endpoint == 'static':
+        return None
+    if db_helper.schema_is_current():
+        _schema_current = True
+        return None
+    return jsonify({
+        'success': False,
+        'message': 'Database is not migrated: run `flask --app app migrate` or start with wsgi.py'
+    }), 503
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    """Add ?v=<content hash> to url_for('static', ...) so the URL changes with the file"""
+    if endpoint != 'static' or 'v' in values:
+        return
+    filename = values.get('filename')
+    if filename and not static_assets.CONTENT_ADDRESSED.match(filename):
+        version = static_assets.fingerprint(app.static_folder, filename)
+        if version:
+            values['v'] = version
+
+
+def serve_static(filename):
+    """Static files, precompressed when a .br/.gz copy exists and cached
+    for a year when the URL carries the file's current fingerprint"""
+    copy = static_assets.precompressed(app.static_folder, filename, request.accept_encodings)
+    if copy:
+        compressed, encoding = copy
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        response = send_from_directory(app.static_folder, compressed, mimetype=mimetype)
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = app.send_static_file(filename)
+    response.vary.add('Accept-Encoding')
+
+    if static_assets.is_immutable(app.static_folder, filename, request.args.get('v')):
+        response.headers['Cache-Control'] = (
+            f'public, max-age={static_assets.IMMUTABLE_MAX_AGE}, immutable')
+    return response
+
+
+app.view_functions['static'] = serve_static
+
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -36,6 +113,67 @@ def login_required(f):
     return decorated_function
 
 
+def kiosk_required(f):
+    """Signed-in users and scanner kiosks registered with KIOSK_TOKEN only"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session and not session.get('kiosk'):
+            return jsonify({
+                'success': False,
+                'message': 'This device is not registered as a scanner kiosk'
+            }), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def rate_limited(f):
+    """Limit a public endpoint to scan_guard.RATE requests per second per client"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        wait = scan_guard.allow(request.remote_addr)
+        if wait:
+            response = jsonify({
+                'success': False,
+                'message': 'Too many requests, please slow down'
+            })
+            response.status_code = 429
+            response.headers['Retry-After'] = str(int(wait) + 1)
+            return response
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def _etag(*scopes):
+    """ETag from the change counters of the data a response is built from
+
+    The query string is part of the tag because pages, searches and
+    breakdowns of the same data are different representations.
+    """
+    versions = db_helper.get_change_versions(*scopes)
+    tag = '-'.join(str(versions[scope]) for scope in scopes)
+    query = request.query_string
+    if query:
+        tag += f'-{zlib.crc32(query):08x}'
+    return tag
+
+
+def _not_modified(etag):
+    """304 response if the client already has this version, else None"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return None
+
+
+def _tagged(response, etag):
+    response.set_etag(etag)
+    # Let the browser keep the body but revalidate it on every request
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
 def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
@@ -86,41 +224,67 @@ def check_password_strength(password):
     }
 
 
-def save_base64_image(image_data, student_id):
-    try:
-        if image_data.startswith('data:image'):
-            if ';base64,' in image_data:
-                format_part = image_data.split(';')[0].split('/')[-1]
-                image_data = image_data.split('base64,')[1]
-            else:
-                format_part = 'jpeg'
-
-            image_binary = base64.b64decode(image_data)
-            ext = 'jpg' if format_part == 'jpeg' else format_part
-            filename = secure_filename(
-                f"{student_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{ext}"
-            )
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-
-            with open(filepath, 'wb') as f:
-                f.write(image_binary)
-
-            image_path = f"images/{filename}"
-            print(
-                f"Image saved successfully: {image_path}, size: {len(image_binary)} bytes")
-            return image_path
+def existing_image_path(image_data):
+    """Stored image path for a form value that refers to an existing photo"""
+    if image_data.startswith('/static/'):
+        return image_data.replace('/static/', '')
 
-        elif image_data.startswith('/static/'):
-            return image_data.replace('/static/', '')
+    elif image_data.startswith('images/'):
+        return image_data
 
-        elif image_data.startswith('images/'):
-            return image_data
+    return None
 
-    except Exception as e:
-        print(f"Error saving image: {e}")
-        raise
 
-    return None
+def student_json(student):
+    """Student row as a dict with URLs and sizes of its photo variants"""
+    data = dict(student)
+    if student['image'] and not student['image'].startswith(('/static/', 'http')):
+        image = photo_jobs.static_image(student['image'])
+        data['photo'] = {
+            size: {
+                'url': url_for('static', filename=variant['path']),
+                'width': variant['width'],
+                'height': variant['height']
+            }
+            for size, variant in db_helper.get_photo_variants(image).items()
+        }
+    return data
+
+
+def _store_import_photos(archive):
+    """Store photos named <idno>.<ext> from a zip, returns idno -> image path"""
+    photos = {}
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        idno, _, ext = os.path.basename(info.filename).rpartition('.')
+        ext = ext.lower()
+        if not idno or ext not in ALLOWED_EXTENSIONS:
+            continue
+        ext = 'jpg' if ext == 'jpeg' else ext
+        with archive.open(info) as src:
+            photos[idno], _ = photo_jobs.store_stream(src, ext)
+    return photos
+
+
+def run_student_import(csv_stream, photos_file=None):
+    """Import a roster CSV (text stream) and an optional zip of photos"""
+    archive = zipfile.ZipFile(photos_file) if photos_file else None
+    try:
+        photos = _store_import_photos(archive) if archive else {}
+        report = db_helper.import_students(csv.DictReader(csv_stream), images=photos)
+
+        # Photos of rows that were not inserted are dropped again unless
+        # another student already uses the same picture
+        inserted = set(report['inserted'])
+        for idno, image_path in photos.items():
+            if idno not in inserted:
+                photo_jobs.remove_photo(image_path)
+        report['photos'] = len(photos)
+        return report
+    finally:
+        if archive:
+            archive.close()
 
 
 @app.route('/')
@@ -133,8 +297,8 @@ def index():
 @app.route('/student-management')
 @login_required
 def student_management():
-    students = db_helper.get_all()
-    return render_template('dashboard/Student_mngt.html', students=students)
+    # Rows are fetched page by page from /api/students
+    return render_template('dashboard/Student_mngt.html')
 
 
 @app.route('/student')
@@ -146,8 +310,8 @@ def student():
 @app.route('/attendance')
 @login_required
 def attendance():
-    students = db_helper.get_all()
-    return render_template('dashboard/attendance.html', students=students)
+    # Attendance rows are loaded from /api/attendance/<date>
+    return render_template('dashboard/attendance.html')
 
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -167,7 +331,11 @@ def login():
             flash('Please enter a valid email address', 'error')
             return render_template('auth/login.html')
 
-        success, user = db_helper.authenticate_user(email, password)
+        try:
+            success, user = db_helper.authenticate_user(email, password)
+        except passwords.Busy:
+            flash('Too many sign-ins right now. Please try again in a moment.', 'error')
+            return render_template('auth/login.html'), 503
 
         if success:
             session['user_id'] = user['id']
@@ -263,6 +431,22 @@ def check_auth():
     return jsonify({'authenticated': 'user_id' in session})
 
 
+@app.route('/api/db/stats')
+@login_required
+def db_stats():
+    """Connection pool, cache, queue, push channel, photo writer, password hashing and scan guard metrics"""
+    return jsonify({
+        'success': True,
+        'pool': db_helper.get_pool_stats(),
+        'cache': db_helper.get_cache_stats(),
+        'queue': attendance_queue.get_stats(),
+        'events': attendance_events.get_stats(),
+        'photos': photo_jobs.get_stats(),
+        'passwords': passwords.get_stats(),
+        'guard': scan_guard.get_stats()
+    })
+
+
 @app.route('/dashboard')
 @login_required
 def dashboard():
@@ -272,12 +456,8 @@ def dashboard():
 @app.route('/admin')
 @login_required
 def admin():
-    students = db_helper.get_all()
     users = db_helper.get_all_users()
-    return render_template('dashboard/admin.html',
-                           student_account=students,
-                           users=users,
-                           students=students)
+    return render_template('dashboard/admin.html', users=users)
 
 
 @app.route('/logout')
@@ -289,6 +469,12 @@ def logout():
 
 @app.route('/scan')
 def scan():
+    # Register this browser as a kiosk: it may then sync the roster
+    token = request.args.get('kiosk')
+    expected = app.config['KIOSK_TOKEN']
+    if token and expected and hmac.compare_digest(token.encode(), expected.encode()):
+        session['kiosk'] = True
+        session.permanent = True
     return render_template('index.html')
 
 
@@ -354,23 +540,18 @@ def delete_user_route(id):
 @app.route('/add_student', methods=['POST'])
 @login_required
 def add_student():
-    image_path = None
     image_data = request.form.get('image_data')
 
     if not image_data:
         flash('Profile photo is required', 'error')
         return redirect(url_for('student'))
 
-    try:
-        student_id = request.form.get('idno')
-        image_path = save_base64_image(image_data, student_id)
-
-        if not image_path:
-            flash('Error saving profile photo', 'error')
-            return redirect(url_for('student'))
+    student_id = request.form.get('idno')
+    # New photos are stored by the photo writer, which then sets the image
+    upload = image_data.startswith('data:image')
+    image_path = None if upload else existing_image_path(image_data)
 
-    except Exception as e:
-        print(f"Error processing image: {e}")
+    if not upload and not image_path:
         flash('Error saving profile photo', 'error')
         return redirect(url_for('student'))
 
@@ -386,15 +567,12 @@ def add_student():
     success, message = db_helper.add_record(student_data)
 
     if success:
+        # Decoding and writing the photo happens off the request
+        if upload:
+            photo_jobs.submit(student_id, image_data)
         flash('Student added successfully!', 'success')
         return redirect(url_for('student_management'))
     else:
-        if image_path and image_path.startswith('images/'):
-            try:
-                os.remove(os.path.join('static', image_path))
-            except Exception as e:
-                print(f"Error deleting image: {e}")
-
         flash(f'Failed to add student: {message}', 'error')
         return redirect(url_for('student'))
 
@@ -405,33 +583,13 @@ def save_student():
     student_id = request.form.get('idno')
 
     existing_student = db_helper.get_student_by_id(student_id)
-    image_path = existing_student['image'] if existing_student else None
-
-    image_data = request.form.get('image_data')
-
-    if image_data:
-        try:
-            if image_data.startswith('data:image'):
-                if image_path and image_path.startswith('images/'):
-                    old_filepath = os.path.join('static', image_path)
-                    if os.path.exists(old_filepath):
-                        try:
-                            os.remove(old_filepath)
-                            print(f"Deleted old image: {old_filepath}")
-                        except Exception as e:
-                            print(f"Error deleting old image: {e}")
-
-                image_path = save_base64_image(image_data, student_id)
+    old_image = existing_student['image'] if existing_student else None
+    image_path = old_image
 
-            elif image_data.startswith('/static/'):
-                image_path = image_data.replace('/static/', '')
-
-            elif image_data.startswith('images/'):
-                image_path = image_data
-
-        except Exception as e:
-            print(f"Error processing image: {e}")
-            flash('Error saving profile photo', 'error')
+    image_data = request.form.get('image_data') or ''
+    upload = image_data.startswith('data:image')
+    if image_data and not upload:
+        image_path = existing_image_path(image_data) or image_path
 
     student_data = {
         'Lastname': request.form.get('lastName'),
@@ -444,6 +602,11 @@ def save_student():
     success, message = db_helper.update_record(student_id, student_data)
 
     if success:
+        if upload:
+            # The writer swaps the image in and removes the old one if unused
+            photo_jobs.submit(student_id, image_data, image_path)
+        elif old_image and old_image != image_path:
+            photo_jobs.remove_photo(old_image)
         flash('Student updated successfully!', 'success')
         return redirect(url_for('student_management'))
     else:
@@ -451,6 +614,16 @@ def save_student():
         return redirect(url_for('student'))
 
 
+@app.route('/api/student/<student_id>/photo_status')
+@login_required
+def photo_status(student_id):
+    """State of the latest background photo write: pending, saved or failed"""
+    job = photo_jobs.get_status(student_id)
+    if job is None:
+        return jsonify({'success': True, 'status': 'unknown'})
+    return jsonify(dict(job, success=True))
+
+
 @app.route('/api/check_student_id/<student_id>')
 def check_student_id(student_id):
     """Check if student ID already exists"""
@@ -490,6 +663,7 @@ def check_student_id(student_id):
 
 
 @app.route('/api/student_public/<student_id>')
+@rate_limited
 def get_student_public(student_id):
     """
     PUBLIC endpoint for QR scanner to fetch student info
@@ -504,7 +678,7 @@ def get_student_public(student_id):
             # Return success response with student data
             return jsonify({
                 'success': True,
-                'student': dict(student)  # Convert Row object to dict
+                'student': student_json(student)  # Row plus photo variants
             })
         else:
             # Student not found in database
@@ -522,22 +696,68 @@ def get_student_public(student_id):
         }), 500
 
 
+# Field order of the compact roster rows
+ROSTER_FIELDS = ('idno', 'Lastname', 'Firstname', 'course', 'level', 'thumb')
+
+
+@app.route('/api/roster')
+@rate_limited
+@kiosk_required
+def get_roster():
+    """
+    Endpoint for registered scanner kiosks to cache the roster offline
+    ?since=<version> returns only students changed or deleted after that
+    version (0 or missing: the full roster), as compact rows in
+    ROSTER_FIELDS order
+    """
+    since = request.args.get('since', 0, type=int)
+    if since < 0:
+        return jsonify({'success': False, 'message': 'since must be a non-negative integer'}), 400
+
+    try:
+        etag = _etag(db_helper.STUDENT_SCOPE)
+        cached = _not_modified(etag)
+        if cached:
+            return cached
+
+        students, deleted, version, more = db_helper.get_roster_changes(since)
+        rows = []
+        for row in students:
+            # The join already tells whether a thumbnail exists
+            if row['thumb']:
+                thumb = url_for('static', filename=row['thumb'])
+            elif row['image'] and row['image'].startswith(('/static/', 'http')):
+                thumb = row['image']
+            elif row['image']:
+                thumb = url_for('static', filename=photo_jobs.static_image(row['image']))
+            else:
+                thumb = None
+            rows.append([row['idno'], row['Lastname'], row['Firstname'],
+                         row['course'], row['level'], thumb])
+        return _tagged(jsonify({
+            'success': True,
+            'version': version,
+            'full': since == 0,
+            'more': more,
+            'fields': ROSTER_FIELDS,
+            'students': rows,
+            'deleted': deleted
+        }), etag)
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
 @app.route('/delete_student/<student_id>')
 @login_required
 def delete_student(student_id):
     student = db_helper.get_student_by_id(student_id)
-    if student and student['image']:
-        image_path = os.path.join('static', student['image'])
-        if os.path.exists(image_path):
-            try:
-                os.remove(image_path)
-                print(f"Deleted image: {image_path}")
-            except Exception as e:
-                print(f"Error deleting image: {e}")
 
     success, message = db_helper.delete_record(student_id)
 
     if success:
+        # Only deleted when no other student shares the same photo
+        if student and student['image']:
+            photo_jobs.remove_photo(student['image'])
         flash('Student deleted successfully!', 'success')
     else:
         flash(f'Failed to delete student: {message}', 'error')
@@ -547,37 +767,256 @@ def delete_student(student_id):
 
 @app.route('/api/student/<student_id>')
 def get_student(student_id):
+    etag = _etag(db_helper.STUDENT_SCOPE)
+    cached = _not_modified(etag)
+    if cached:
+        return cached
+
     student = db_helper.get_student_by_id(student_id)
     if student:
-        return jsonify({
+        return _tagged(jsonify({
             'success': True,
-            'student': dict(student)
-        })
+            'student': student_json(student)
+        }), etag)
     return jsonify({'success': False, 'message': 'Student not found'}), 404
 
 
+@app.route('/api/students')
+@login_required
+def list_students():
+    """Paginated, filtered and sorted student list for Student_mngt.html"""
+    try:
+        etag = _etag(db_helper.STUDENT_SCOPE)
+        cached = _not_modified(etag)
+        if cached:
+            return cached
+
+        page = db_helper.get_students_page(
+            search=request.args.get('q', '').strip() or None,
+            course=request.args.get('course') or None,
+            level=request.args.get('level') or None,
+            sort=request.args.get('sort', 'idno'),
+            order=request.args.get('order', 'asc'),
+            cursor=request.args.get('cursor') or None,
+            limit=request.args.get('limit', 50, type=int)
+        )
+        return _tagged(jsonify({
+            'success': True,
+            'students': [dict(row) for row in page['students']],
+            'next_cursor': page['next_cursor'],
+            'total': page['total']
+        }), etag)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/api/students/import', methods=['POST'])
+@login_required
+def import_students():
+    """Bulk import students from an uploaded CSV (file) and optional photo zip (photos)"""
+    roster = request.files.get('file')
+    if not roster:
+        return jsonify({'success': False, 'message': 'CSV file is required'}), 400
+
+    try:
+        stream = io.TextIOWrapper(roster.stream, encoding='utf-8-sig', newline='')
+        report = run_student_import(stream, request.files.get('photos'))
+    except zipfile.BadZipFile:
+        return jsonify({'success': False, 'message': 'Photos must be a zip archive'}), 400
+    except (UnicodeDecodeError, csv.Error) as e:
+        return jsonify({'success': False, 'message': f'Invalid CSV: {e}'}), 400
+
+    return jsonify({
+        'success': True,
+        'inserted': len(report['inserted']),
+        'rows': report['rows'],
+        'photos': report['photos'],
+        'errors': report['errors'],
+        'seconds': report['seconds'],
+        'rows_per_second': report['rows_per_second']
+    })
+
+
+@app.route('/api/students/search')
+@login_required
+def search_students():
+    """Ranked full-text student search (prefix and typo-tolerant)"""
+    try:
+        etag = _etag(db_helper.STUDENT_SCOPE)
+        cached = _not_modified(etag)
+        if cached:
+            return cached
+
+        query = request.args.get('q', '').strip()
+        limit = request.args.get('limit', 20, type=int)
+        students, fuzzy = db_helper.search_students(query, limit)
+        return _tagged(jsonify({
+            'success': True,
+            'students': [dict(row) for row in students],
+            'fuzzy': fuzzy
+        }), etag)
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value or '', '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def _export_chunks(date_from, date_to, fmt):
+    """Encode attendance rows batch by batch as CSV or NDJSON text"""
+    columns = db_helper.EXPORT_COLUMNS
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    if fmt == 'csv':
+        writer.writerow(columns)
+    for rows in db_helper.iter_attendance_range(date_from, date_to):
+        for row in rows:
+            if fmt == 'csv':
+                writer.writerow(tuple(row))
+            else:
+                buffer.write(json.dumps(dict(zip(columns, row))) + '\n')
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@app.route('/api/attendance/export')
+@login_required
+def export_attendance():
+    """Stream attendance for a date range as CSV or NDJSON, optionally gzipped"""
+    date_from = _parse_date(request.args.get('from'))
+    date_to = _parse_date(request.args.get('to'))
+    fmt = request.args.get('format', 'csv')
+    compress = request.args.get('gzip') in ('1', 'true')
+
+    if not date_from or not date_to:
+        return jsonify({'success': False, 'message': 'from and to must be YYYY-MM-DD dates'}), 400
+    if date_from > date_to:
+        return jsonify({'success': False, 'message': 'from must not be after to'}), 400
+    if fmt not in ('csv', 'ndjson'):
+        return jsonify({'success': False, 'message': 'format must be csv or ndjson'}), 400
+
+    chunks = _export_chunks(date_from.isoformat(), date_to.isoformat(), fmt)
+    filename = f"attendance_{date_from}_{date_to}.{fmt}"
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    if compress:
+        chunks = _gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+
+    # stream_with_context keeps the request (and its pooled connection)
+    # alive until the last batch has been sent
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
 @app.route('/api/attendance/<date>')
 @login_required
 def get_attendance(date):
     try:
+        # The report joins student names and counts every student
+        etag = _etag(db_helper.attendance_scope(date), db_helper.STUDENT_SCOPE)
+        cached = _not_modified(etag)
+        if cached:
+            return cached
+
+        # Read the cursor first: changes racing the report are sent again
+        # by the changes feed rather than lost
+        cursor = db_helper.get_attendance_cursor()
         attendance_records = db_helper.get_attendance_by_date(date)
         stats = db_helper.get_attendance_stats(date)
 
-        return jsonify({
+        response = {
             'success': True,
             'attendance': [dict(row) for row in attendance_records],
-            'stats': stats
-        })
+            'stats': stats,
+            'cursor': cursor
+        }
+
+        breakdown = request.args.get('breakdown')
+        if breakdown:
+            response['breakdown'] = db_helper.get_attendance_stats(
+                date, group_by=breakdown)
+
+        return _tagged(jsonify(response), etag)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+@app.route('/api/attendance/<date>/changes')
+@login_required
+def get_attendance_changes(date):
+    """Rows of a date changed since a cursor from /api/attendance/<date> or a previous call"""
+    since = request.args.get('since', type=int)
+    if since is None or since < 0:
+        return jsonify({'success': False, 'message': 'since must be a non-negative integer'}), 400
+
+    try:
+        rows, cursor, more = db_helper.get_attendance_changes(date, since)
+        response = {
+            'success': True,
+            'changes': [dict(row) for row in rows],
+            'cursor': cursor,
+            'more': more
+        }
+        if rows:
+            response['stats'] = db_helper.get_attendance_stats(date)
+        return jsonify(response)
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@app.route('/api/attendance/stream')
+@login_required
+def attendance_stream():
+    """Server-Sent Events: attendance changes pushed to open dashboards
+
+    Events only name the date that changed; dashboards fetch the rows
+    from /api/attendance/<date>/changes. A 'resync' event means events
+    were dropped because the client fell behind.
+    """
+    client = attendance_events.subscribe()
+    if client is None:
+        return jsonify({'success': False, 'message': 'Too many open streams'}), 503
+
+    # No stream_with_context: the stream must not hold a pooled connection
+    return Response(
+        attendance_events.stream(client),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 # ============================================
 # FIXED: Update attendance marking endpoint
 # Make it work for both authenticated and public access
 # ============================================
 
 @app.route('/api/attendance/mark', methods=['POST'])
+@rate_limited
 def mark_attendance_public():
     """
     PUBLIC endpoint to mark attendance from QR scanner
@@ -598,15 +1037,44 @@ def mark_attendance_public():
                 'message': 'Missing required fields'
             }), 400
 
+        # The scanner fires several times while a badge is in view
+        if scan_guard.recent_scan(student_idno, date, status):
+            return jsonify({
+                'success': True,
+                'message': 'Attendance already recorded',
+                'created': False,
+                'duplicate': True
+            })
+
+        if app.config['ATTENDANCE_WRITE_BEHIND']:
+            if not attendance_queue.enqueue(student_idno, date, time_in, status):
+                return jsonify({
+                    'success': False,
+                    'message': 'Attendance queue is full, please retry'
+                }), 503
+
+            scan_guard.remember_scan(student_idno, date, {
+                'date': date, 'time_in': time_in, 'time_out': None, 'status': status})
+            return jsonify({
+                'success': True,
+                'message': 'Attendance queued',
+                'queued': True
+            }), 202
+
         # Mark attendance in database
-        success, message = db_helper.mark_attendance(
+        success, message, created = db_helper.mark_attendance(
             student_idno, date, time_in, status
         )
 
         if success:
+            attendance_events.publish('attendance', action='mark', date=date,
+                                      student_idno=student_idno, status=status)
+            scan_guard.remember_scan(student_idno, date, {
+                'date': date, 'time_in': time_in, 'time_out': None, 'status': status})
             return jsonify({
                 'success': True,
-                'message': message
+                'message': message,
+                'created': created
             })
         else:
             return jsonify({
@@ -622,6 +1090,141 @@ def mark_attendance_public():
         }), 500
 
 
+@app.route('/api/attendance/scan', methods=['POST'])
+@rate_limited
+def scan_attendance():
+    """
+    PUBLIC endpoint for the QR scanner: one round trip per scan
+    Validates the student, marks attendance and returns the profile,
+    today's attendance and whether the student had already been scanned
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        student_idno = data.get('student_idno')
+        date = data.get('date')
+        time_in = data.get('time_in')
+        status = data.get('status', 'PRESENT')
+
+        if not student_idno or not date or not time_in:
+            return jsonify({
+                'success': False,
+                'message': 'Missing required fields'
+            }), 400
+
+        student = db_helper.get_student_by_id(student_idno)
+        if not student:
+            return jsonify({
+                'success': False,
+                'message': 'Student not found'
+            }), 404
+
+        # Repeats of the same badge are answered without another write
+        attendance = scan_guard.recent_scan(student_idno, date, status)
+        if attendance:
+            return jsonify({
+                'success': True,
+                'message': 'Attendance already recorded',
+                'student': student_json(student),
+                'attendance': attendance,
+                'duplicate': True
+            })
+
+        if app.config['ATTENDANCE_WRITE_BEHIND']:
+            existing = db_helper.get_attendance_record(student_idno, date)
+            if not attendance_queue.enqueue(student_idno, date, time_in, status):
+                return jsonify({
+                    'success': False,
+                    'message': 'Attendance queue is full, please retry'
+                }), 503
+            scan_guard.remember_scan(student_idno, date, {
+                'date': date, 'time_in': time_in, 'time_out': None, 'status': status})
+            return jsonify({
+                'success': True,
+                'message': 'Attendance queued',
+                'queued': True,
+                'student': student_json(student),
+                'attendance': {'date': date, 'time_in': time_in, 'time_out': None, 'status': status},
+                'duplicate': existing is not None
+            }), 202
+
+        success, message, created = db_helper.mark_attendance(
+            student_idno, date, time_in, status
+        )
+        if not success:
+            return jsonify({
+                'success': False,
+                'message': message
+            }), 400
+
+        attendance_events.publish('attendance', action='mark', date=date,
+                                  student_idno=student_idno, status=status)
+        record = db_helper.get_attendance_record(student_idno, date)
+        if record:
+            scan_guard.remember_scan(student_idno, date, dict(record))
+        return jsonify({
+            'success': True,
+            'message': message,
+            'student': student_json(student),
+            'attendance': dict(record) if record else None,
+            'duplicate': not created
+        })
+
+    except Exception as e:
+        print(f"Error scanning attendance: {e}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+
+# Upper bound on scans accepted by one batch request
+MAX_BATCH_SCANS = 1000
+
+
+@app.route('/api/attendance/mark_batch', methods=['POST'])
+@rate_limited
+def mark_attendance_batch():
+    """
+    PUBLIC endpoint for scanners replaying buffered scans
+    Accepts {"scans": [...]} and applies them in a single transaction
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        scans = data.get('scans')
+
+        if not isinstance(scans, list) or not scans:
+            return jsonify({
+                'success': False,
+                'message': 'scans must be a non-empty list'
+            }), 400
+
+        if len(scans) > MAX_BATCH_SCANS:
+            return jsonify({
+                'success': False,
+                'message': f'At most {MAX_BATCH_SCANS} scans per request'
+            }), 413
+
+        success, message, results = db_helper.mark_attendance_batch(scans)
+        if success:
+            attendance_events.publish_batch(scans, results)
+            for scan, result in zip(scans, results):
+                if result.get('status') == 'applied':
+                    scan_guard.forget_scan(scan['student_idno'], scan['date'])
+
+        return jsonify({
+            'success': success,
+            'message': message,
+            'results': results
+        }), 200 if success else 500
+
+    except Exception as e:
+        print(f"Error marking attendance batch: {e}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+
 @app.route('/api/attendance/update_status', methods=['POST'])
 @login_required
 def update_attendance_status():
@@ -632,16 +1235,139 @@ def update_attendance_status():
         status = data.get('status')
         time_out = data.get('time_out')
 
-        success, message = db_helper.update_attendance_status(
-            student_idno, date, status, time_out)
+        success, message, created = db_helper.update_attendance_status(
+            student_idno, date, status, time_out=time_out)
 
         if success:
-            return jsonify({'success': True, 'message': message})
+            scan_guard.forget_scan(student_idno, date)
+            attendance_events.publish('attendance', action='update', date=date,
+                                      student_idno=student_idno, status=status)
+            return jsonify({'success': True, 'message': message, 'created': created})
         else:
             return jsonify({'success': False, 'message': message}), 400
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+# ============================================
+# MAINTENANCE COMMANDS (flask --app app <command>)
+# ============================================
+
+@app.cli.command('check-plans')
+def check_plans_command():
+    """Fail if a hot db_helper query falls back to a full scan or sort"""
+    problems = db_helper.check_query_plans()
+    for name, details in problems.items():
+        print(f"{name}: {'; '.join(details)}")
+    if problems:
+        raise SystemExit(1)
+    print(f"All {len(db_helper.HOT_QUERIES)} hot queries use indexes")
+
+
+@app.cli.command('migrate')
+@click.option('--dry-run', is_flag=True, help='Report pending migrations and estimated rows touched')
+@click.option('--target', type=int, help='Stop after this schema version')
+def migrate_command(dry_run, target):
+    """Create the database if needed and apply pending schema migrations"""
+    if not dry_run:
+        db_helper.init_db(migrate=False)
+    print(f"Schema version: {db_helper.get_schema_version()}")
+    report = db_helper.run_migrations(dry_run=dry_run, target=target)
+    if not report:
+        print("No pending migrations")
+    for entry in report:
+        print(f"{'Pending' if dry_run else 'Applied'} {entry['version']}: {entry['description']}")
+        for step in entry['steps']:
+            print(f"    ~{step['estimated_rows']} rows  {step['step']}")
+
+
+@app.cli.command('import-students')
+@click.argument('csv_path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--photos', type=click.Path(exists=True, dir_okay=False), help='Zip of photos named <idno>.<ext>')
+def import_students_command(csv_path, photos):
+    """Bulk import a student roster CSV"""
+    with open(csv_path, encoding='utf-8-sig', newline='') as roster:
+        report = run_student_import(roster, photos)
+
+    for error in report['errors']:
+        print(f"line {error['line']} ({error['idno']}): {error['message']}")
+    print(f"Imported {len(report['inserted'])} of {report['rows']} rows "
+          f"in {report['seconds']}s ({report['rows_per_second']} rows/s), "
+          f"{len(report['errors'])} errors")
+
+
+@app.cli.command('photo-variants')
+@click.option('--all', 'redo', is_flag=True, help='Regenerate variants of every photo')
+def photo_variants_command(redo):
+    """Create resized variants for student photos that have none (or, with --all, rebuild them)"""
+    if photo_jobs.Image is None:
+        raise click.ClickException('Resizing photos requires Pillow (pip install Pillow)')
+
+    if redo:
+        images = [row['image'] for row in db_helper.get_all() if row['image']]
+    else:
+        images = db_helper.get_images_without_variants()
+    # Students may share a photo: resize each stored file once
+    images = dict.fromkeys(photo_jobs.static_image(image) for image in images)
+
+    made = failed = 0
+    for image in images:
+        try:
+            variants = photo_jobs.make_variants(image, force=redo)
+        except Exception as e:
+            failed += 1
+            print(f"{image}: {e}")
+            continue
+        made += 1
+        sizes = ', '.join(f"{size} {w}x{h} {size_bytes // 1024} KB"
+                          for size, (path, w, h, size_bytes) in variants.items())
+        print(f"{image}: {sizes}")
+    print(f"Resized {made} photos, {failed} failed")
+
+
+@app.cli.command('photo-gc')
+@click.option('--dry-run', is_flag=True, help='Only report what would be removed')
+@click.option('--min-age', default=60, show_default=True, help='Minutes a file must be unchanged before it can go')
+def photo_gc_command(dry_run, min_age):
+    """Remove photo files that no student refers to"""
+    report = photo_jobs.collect_garbage(min_age=min_age * 60, dry_run=dry_run)
+    verb = 'Would remove' if dry_run else 'Removed'
+    print(f"{verb} {report['removed']} of {report['files']} files "
+          f"({report['bytes'] // 1024} KB), kept {report['kept']}, "
+          f"{report['too_new']} newer than {min_age} min")
+
+
+@app.cli.command('compress-static')
+@click.option('--force', is_flag=True, help='Rewrite copies that are up to date')
+def compress_static_command(force):
+    """Write .gz (and .br with the brotli package) copies of static CSS/JS"""
+    report = static_assets.compress_all(app.static_folder, force=force)
+    for filename, size, gz_size, br_size in report:
+        br = f", br {br_size // 1024} KB" if br_size is not None else ''
+        print(f"{filename}: {size // 1024} KB, gz {gz_size // 1024} KB{br}")
+    if static_assets.brotli is None:
+        print("brotli is not installed, only .gz copies were written")
+
+
+@app.cli.command('bench-passwords')
+@click.option('--target', default=20, show_default=True, help='Logins per second the server must sustain')
+def bench_passwords_command(target):
+    """Time password hashing at several scrypt costs against a login target"""
+    print(f"{passwords.WORKERS} hashing workers, r={passwords.SCRYPT_R}, p={passwords.SCRYPT_P}")
+    for shift in range(12, 18):
+        n = 2 ** shift
+        ms = passwords.benchmark(n)
+        rate = passwords.WORKERS * 1000 / ms
+        marks = []
+        if n == passwords.SCRYPT_N:
+            marks.append('current')
+        if rate < target:
+            marks.append('below target')
+        print(f"N=2**{shift}: {ms:.1f} ms/login, ~{rate:.0f} logins/s"
+              + (f"  ({', '.join(marks)})" if marks else ''))
+
+
 if __name__ == '__main__':
+    # Development server with the debugger; production runs wsgi.py
+    db_helper.ensure_db()
     app.run(debug=True)
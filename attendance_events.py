@@ -0,0 +1,99 @@
+import json
+import queue
+import threading
+
+# Push channel settings
+# Open streams before subscribe() refuses more. Each stream holds a server
+# thread while open, so this stays below the thread count to leave threads
+# for scans (wsgi.py sets it to half of WEB_THREADS unless MAX_STREAMS is set)
+MAX_CLIENTS: int = 16
+CLIENT_BUFFER: int = 100        # events held per client before it is marked lagging
+HEARTBEAT_SECONDS: int = 15     # comment line sent to idle streams
+
+_clients = set()
+_lock = threading.Lock()
+_stats = {
+    'published': 0,
+    'delivered': 0,
+    'dropped': 0,
+    'rejected': 0,
+}
+
+
+class _Client:
+    def __init__(self):
+        self.events = queue.Queue(maxsize=CLIENT_BUFFER)
+        # Set when events were dropped; the client is told to resync
+        self.lagging = False
+
+
+def subscribe():
+    """Register a client, returns None when MAX_CLIENTS are connected"""
+    with _lock:
+        if len(_clients) >= MAX_CLIENTS:
+            _stats['rejected'] += 1
+            return None
+        client = _Client()
+        _clients.add(client)
+        return client
+
+
+def unsubscribe(client):
+    with _lock:
+        _clients.discard(client)
+
+
+def publish(kind, **data):
+    """Send an event to every connected client without ever blocking"""
+    message = (kind, data)
+    with _lock:
+        _stats['published'] += 1
+        for client in _clients:
+            try:
+                client.events.put_nowait(message)
+                _stats['delivered'] += 1
+            except queue.Full:
+                client.lagging = True
+                _stats['dropped'] += 1
+
+
+def publish_batch(scans, results):
+    """One event per date changed by mark_attendance_batch() results"""
+    dates = {}
+    for scan, result in zip(scans, results):
+        if result.get('status') == 'applied':
+            dates[scan['date']] = dates.get(scan['date'], 0) + 1
+    for date, count in dates.items():
+        publish('attendance', action='batch', date=date, count=count)
+
+
+def stream(client):
+    """Yield SSE text for a client until it disconnects"""
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                kind, data = client.events.get(timeout=HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+
+            if client.lagging:
+                # Events were lost: drop the backlog and ask for a full resync
+                client.lagging = False
+                while not client.events.empty():
+                    client.events.get_nowait()
+                kind, data = 'resync', {}
+            yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+    finally:
+        unsubscribe(client)
+
+
+def get_stats():
+    """Get connected client and event counters"""
+    with _lock:
+        stats = dict(_stats)
+        stats['clients'] = len(_clients)
+        stats['buffered'] = sum(client.events.qsize() for client in _clients)
+    stats['max_clients'] = MAX_CLIENTS
+    return stats
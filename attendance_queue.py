@@ -0,0 +1,169 @@
+import atexit
+import queue
+import threading
+import time
+
+import attendance_events
+import db_helper
+
+# Write-behind settings
+MAX_QUEUE_SIZE: int = 5000      # scans held before enqueue() refuses more
+FLUSH_INTERVAL_MS: int = 200    # flush at least this often while scans wait
+FLUSH_EVENTS: int = 250         # or as soon as this many scans are waiting
+# A batch whose flush fails (e.g. database locked) is retried with
+# exponential backoff, and dropped (and logged) after MAX_ATTEMPTS
+MAX_ATTEMPTS: int = 6
+RETRY_BACKOFF_MS: int = 500
+MAX_BACKOFF_MS: int = 10000
+
+_queue = queue.Queue(maxsize=MAX_QUEUE_SIZE)
+_stop = threading.Event()
+_lock = threading.Lock()
+_writer = None
+_stats = {
+    'enqueued': 0,
+    'rejected': 0,
+    'flushed': 0,
+    'failed': 0,
+    'retries': 0,
+    'dropped': 0,
+    'flushes': 0,
+    'last_flush_ms': 0.0,
+    'max_flush_ms': 0.0,
+    'total_flush_ms': 0.0,
+}
+
+
+def _flush(batch):
+    """Write a batch in one transaction, returns False if it must be retried"""
+    started = time.perf_counter()
+    success, message, results = db_helper.mark_attendance_batch(batch)
+    elapsed = (time.perf_counter() - started) * 1000
+
+    with _lock:
+        _stats['flushes'] += 1
+        _stats['last_flush_ms'] = elapsed
+        _stats['max_flush_ms'] = max(_stats['max_flush_ms'], elapsed)
+        _stats['total_flush_ms'] += elapsed
+    if not success:
+        print(f"Error flushing attendance queue: {message}")
+        return False
+
+    applied = sum(1 for result in results if result.get('status') == 'applied')
+    attendance_events.publish_batch(batch, results)
+    with _lock:
+        _stats['flushed'] += applied
+        # Scans rejected as invalid; they would fail again on retry
+        _stats['failed'] += len(batch) - applied
+    return True
+
+
+def _drop(batch, attempts):
+    print(f"Dropping {len(batch)} attendance scans after {attempts} failed flushes:")
+    for scan in batch:
+        print(f"    {scan['student_idno']} {scan['date']} {scan['time_in']} {scan['status']}")
+    with _lock:
+        _stats['dropped'] += len(batch)
+
+
+def _run():
+    interval = FLUSH_INTERVAL_MS / 1000
+    batch = []
+    attempts = 0
+    try:
+        while True:
+            if not batch:
+                try:
+                    batch = [_queue.get(timeout=interval)]
+                except queue.Empty:
+                    if _stop.is_set():
+                        break
+                    continue
+
+                # Group commit: keep collecting until the window closes or the
+                # batch is full, then write everything in one transaction
+                deadline = time.monotonic() + interval
+                while len(batch) < FLUSH_EVENTS:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(_queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+
+            # These scans were acknowledged already: a failed batch is kept
+            # and retried rather than lost
+            if not _flush(batch):
+                attempts += 1
+                if attempts < MAX_ATTEMPTS:
+                    with _lock:
+                        _stats['retries'] += 1
+                    # Stopping cuts the wait short, not the number of attempts
+                    _stop.wait(min(MAX_BACKOFF_MS, RETRY_BACKOFF_MS * 2 ** (attempts - 1)) / 1000)
+                    continue
+                _drop(batch, attempts)
+
+            for _ in batch:
+                _queue.task_done()
+            batch = []
+            attempts = 0
+    finally:
+        db_helper.release_connection()
+
+
+def start():
+    """Start the background writer thread if it is not running"""
+    global _writer
+    with _lock:
+        if _writer is not None and _writer.is_alive():
+            return
+        _stop.clear()
+        _writer = threading.Thread(
+            target=_run, name='attendance-writer', daemon=True)
+        _writer.start()
+
+
+def enqueue(student_idno, date, time_in, status='PRESENT'):
+    """Queue a scan for the writer, returns False when the queue is full"""
+    start()
+    try:
+        _queue.put_nowait({
+            'student_idno': student_idno,
+            'date': date,
+            'time_in': time_in,
+            'status': status,
+        })
+    except queue.Full:
+        with _lock:
+            _stats['rejected'] += 1
+        return False
+    with _lock:
+        _stats['enqueued'] += 1
+    return True
+
+
+def stop(timeout=10):
+    """Drain queued scans to the database and stop the writer"""
+    global _writer
+    writer = _writer
+    if writer is None:
+        return
+    _stop.set()
+    writer.join(timeout)
+    _writer = None
+
+
+def get_stats():
+    """Get queue depth and flush latency metrics"""
+    with _lock:
+        stats = dict(_stats)
+    flushes = stats.pop('total_flush_ms')
+    stats['avg_flush_ms'] = flushes / stats['flushes'] if stats['flushes'] else 0.0
+    stats['depth'] = _queue.qsize()
+    stats['capacity'] = MAX_QUEUE_SIZE
+    stats['running'] = _writer is not None and _writer.is_alive()
+    return stats
+
+
+atexit.register(stop)
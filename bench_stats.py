@@ -0,0 +1,79 @@
+"""Benchmark attendance statistics: the old three-COUNT version against the
+single-query version, plus the grouped breakdown and the daily report.
+
+Runs against a throwaway database, never db/Campus.db:
+
+    python bench_stats.py [students] [repeat]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+STUDENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+REPEAT = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+DATE = '2025-12-15'
+
+# db_helper creates db/Campus.db relative to the working directory on import
+os.chdir(tempfile.mkdtemp(prefix='bench_stats_'))
+import db_helper  # noqa: E402
+
+db_helper.init_db()
+
+
+def three_count_stats(date):
+    """The previous get_attendance_stats(): three separate COUNT queries"""
+    cursor = db_helper.get_connection().cursor()
+    total = cursor.execute(
+        "SELECT COUNT(*) FROM student_account").fetchone()[0]
+    present = cursor.execute(
+        "SELECT COUNT(*) FROM attendance WHERE date = ? AND status = 'PRESENT'",
+        (date,)).fetchone()[0]
+    late = cursor.execute(
+        "SELECT COUNT(*) FROM attendance WHERE date = ? AND status = 'LATE'",
+        (date,)).fetchone()[0]
+    return {'total': total, 'present': present, 'late': late,
+            'absent': total - present - late}
+
+
+def seed(students):
+    conn = db_helper.get_connection()
+    courses = ['BSIT', 'BSCS', 'BSIS', 'BSEMC']
+    conn.executemany(
+        "INSERT INTO student_account (idno, Lastname, Firstname, course, level) VALUES (?, ?, ?, ?, ?)",
+        ((str(100000 + i), f"Last{i % 997}", f"First{i}",
+          random.choice(courses), random.randint(1, 4))
+         for i in range(students))
+    )
+    conn.executemany(
+        "INSERT INTO attendance (student_idno, date, time_in, status) VALUES (?, ?, ?, ?)",
+        ((str(100000 + i), DATE, '07:30', random.choice(['PRESENT', 'LATE']))
+         for i in range(students) if random.random() < 0.8)
+    )
+    conn.commit()
+
+
+def timed(label, func):
+    func()
+    started = time.perf_counter()
+    for _ in range(REPEAT):
+        result = func()
+    elapsed = (time.perf_counter() - started) / REPEAT * 1000
+    print(f"{label:<40} {elapsed:9.2f} ms")
+    return result
+
+
+if __name__ == '__main__':
+    random.seed(0)
+    seed(STUDENTS)
+    print(f"{STUDENTS} students, {REPEAT} runs each, date {DATE}")
+
+    old = timed("3 COUNT queries", lambda: three_count_stats(DATE))
+    new = timed("single query", lambda: db_helper.get_attendance_stats(DATE))
+    timed("grouped query by course",
+          lambda: db_helper.get_attendance_stats(DATE, group_by='course'))
+    timed("daily report (get_attendance_by_date)",
+          lambda: db_helper.get_attendance_by_date(DATE))
+
+    assert old == new, (old, new)
@@ -1,17 +1,191 @@
 from sqlite3 import connect, Row
+import atexit
 import os
+import base64
+import json
+import queue
+import re
+import threading
+from collections import OrderedDict
+import time
 from datetime import datetime
 
+import migrations
+import passwords
+
 # Ensure the db folder exists
 if not os.path.exists('db'):
     os.makedirs('db')
 
 database: str = 'db/Campus.db'
 
+# Connection pool settings
+POOL_SIZE: int = 8
+STATEMENT_CACHE_SIZE: int = 128
+
+# Storage profile: WAL lets readers run alongside a writer, busy_timeout
+# makes concurrent writers wait their turn instead of failing
+STORAGE_PROFILE = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 64 * 1024 * 1024,
+    'cache_size': -16000,
+    'temp_store': 'MEMORY',
+}
+
+# Checkpoint policy: auto-checkpoint after this many WAL pages, and the
+# mode used by checkpoint() (PASSIVE, FULL, RESTART or TRUNCATE)
+CHECKPOINT_PAGES: int = 1000
+CHECKPOINT_MODE: str = 'PASSIVE'
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_local = threading.local()
+_stats_lock = threading.Lock()
+_pool_stats = {'opened': 0, 'reused': 0, 'released': 0, 'closed': 0}
+
+
+def _count(key):
+    with _stats_lock:
+        _pool_stats[key] += 1
+
+
+def _apply_pragmas(conn):
+    profile = STORAGE_PROFILE
+    conn.execute(f"PRAGMA busy_timeout = {int(profile['busy_timeout'])}")
+    conn.execute(f"PRAGMA synchronous = {profile['synchronous']}")
+    conn.execute(f"PRAGMA mmap_size = {int(profile['mmap_size'])}")
+    conn.execute(f"PRAGMA cache_size = {int(profile['cache_size'])}")
+    conn.execute(f"PRAGMA temp_store = {profile['temp_store']}")
+    conn.execute(f"PRAGMA wal_autocheckpoint = {int(CHECKPOINT_PAGES)}")
+
+
+def _open_connection():
+    # IMMEDIATE takes the write lock when a write transaction starts, so a
+    # busy writer waits on busy_timeout rather than failing mid-transaction
+    conn = connect(database, check_same_thread=False,
+                   timeout=STORAGE_PROFILE['busy_timeout'] / 1000,
+                   isolation_level='IMMEDIATE',
+                   cached_statements=STATEMENT_CACHE_SIZE)
+    conn.row_factory = Row
+    _apply_pragmas(conn)
+    _count('opened')
+    return conn
+
+
+def get_connection():
+    """Get the connection bound to the current thread, reusing a pooled one if available"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        return conn
+    try:
+        conn = _pool.get_nowait()
+        _count('reused')
+    except queue.Empty:
+        conn = _open_connection()
+    _local.conn = conn
+    return conn
+
+
+def release_connection(exception=None):
+    """Return the current thread's connection to the pool (Flask teardown hook)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        return
+    _local.conn = None
+    if conn.in_transaction:
+        conn.rollback()
+    try:
+        _pool.put_nowait(conn)
+        _count('released')
+    except queue.Full:
+        conn.close()
+        _count('closed')
+
+
+def _rollback():
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
+def checkpoint(mode=None):
+    """Run a WAL checkpoint, returns (busy, wal_pages, checkpointed_pages)"""
+    mode = (mode or CHECKPOINT_MODE).upper()
+    if mode not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+        raise ValueError(f"Unknown checkpoint mode: {mode}")
+    conn = get_connection()
+    row = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    return tuple(row)
+
+
+def get_storage_info():
+    """Get the PRAGMA values in effect on the current connection"""
+    conn = get_connection()
+    info = {}
+    for name in list(STORAGE_PROFILE) + ['wal_autocheckpoint']:
+        info[name] = conn.execute(f"PRAGMA {name}").fetchone()[0]
+    return info
+
+
+def close_all_connections():
+    """Checkpoint the WAL and close every idle pooled connection"""
+    try:
+        checkpoint('TRUNCATE')
+    except Exception as e:
+        print(f"Error checkpointing database: {e}")
+    release_connection()
+    while True:
+        try:
+            conn = _pool.get_nowait()
+        except queue.Empty:
+            break
+        conn.close()
+        _count('closed')
+
+
+def run_migrations(dry_run=False, target=None):
+    """Apply (or with dry_run, only report) pending schema migrations"""
+    try:
+        return migrations.migrate(get_connection(), dry_run=dry_run, target=target)
+    except Exception:
+        _rollback()
+        raise
+
 
-def init_db():
-    conn = connect(database)
+def get_schema_version():
+    """Get the applied schema version"""
+    return migrations.get_version(get_connection())
+
+
+def get_pool_stats():
+    """Get connection pool counters"""
+    with _stats_lock:
+        stats = dict(_pool_stats)
+    stats['idle'] = _pool.qsize()
+    return stats
+
+
+def init_db(profile=None, checkpoint_pages=None, checkpoint_mode=None, migrate=True):
+    """Create tables and apply the storage profile (overrides merge into STORAGE_PROFILE)
+
+    With migrate=False only the original tables are created and pending
+    migrations are left to run_migrations().
+    """
+    global CHECKPOINT_PAGES, CHECKPOINT_MODE
+    if profile:
+        STORAGE_PROFILE.update(profile)
+    if checkpoint_pages is not None:
+        CHECKPOINT_PAGES = checkpoint_pages
+    if checkpoint_mode is not None:
+        CHECKPOINT_MODE = checkpoint_mode
+    # Connections opened under the old profile are dropped
+    close_all_connections()
+
+    conn = get_connection()
     cursor = conn.cursor()
+    # journal_mode is stored in the database file, set it once here
+    cursor.execute(f"PRAGMA journal_mode = {STORAGE_PROFILE['journal_mode']}")
     # Create Users Table
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS user (
@@ -46,78 +220,184 @@ def init_db():
         )
     """)
     conn.commit()
-    conn.close()
+    # Everything added after the original tables ships as a migration
+    if migrate:
+        migrations.migrate(conn)
+    release_connection()
 
 
-def getprocessor():
-    conn = connect(database)
-    conn.row_factory = Row
-    return conn
+def schema_is_current():
+    """Check, without writing, that every migration has been applied
 
+    Uses its own connection, so no pooled connection is opened.
+    """
+    conn = _open_connection()
+    try:
+        return migrations.is_current(conn)
+    finally:
+        conn.close()
+        _count('closed')
+
+
+def ensure_db():
+    """Run init_db() unless the schema is already current
+
+    For launchers, once, before the server starts: importing the app never
+    migrates. No pooled connection is left open afterwards, so none is
+    inherited by forked workers.
+    """
+    if not schema_is_current():
+        init_db()
+        close_all_connections()
+
+# --- LOOKUP CACHE ---
+
+# Bounded LRU + TTL caches in front of the per-scan lookups. Entries are
+# dropped by the write functions below; the TTL bounds staleness for
+# writes made by other processes. A lookup takes the cache's generation
+# before it queries, and its result is only stored if nothing was
+# invalidated since: a row read before a write can't outlive the write.
+CACHE_SIZE: int = 4096
+CACHE_TTL: float = 30.0
+
+_MISSING = object()
+
+
+class _LookupCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0, 'stale': 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return _MISSING
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return _MISSING
+            self._data.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def put(self, key, value, generation):
+        with self._lock:
+            if generation != self.generation:
+                self.stats['stale'] += 1
+                return
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def invalidate(self, key=None):
+        with self._lock:
+            self.generation += 1
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def info(self):
+        with self._lock:
+            return dict(self.stats, size=len(self._data), maxsize=self.maxsize, ttl=self.ttl)
+
+
+_student_cache = _LookupCache(CACHE_SIZE, CACHE_TTL)
+_user_cache = _LookupCache(CACHE_SIZE, CACHE_TTL)
+_variant_cache = _LookupCache(CACHE_SIZE, CACHE_TTL)
+
+
+def get_cache_stats():
+    """Get hit/miss/eviction counters of the lookup caches"""
+    return {'student': _student_cache.info(), 'user': _user_cache.info(),
+            'photo_variant': _variant_cache.info()}
+
+
+def clear_caches():
+    """Drop every cached lookup"""
+    _student_cache.invalidate()
+    _user_cache.invalidate()
+    _variant_cache.invalidate()
 
-def postprocess():
-    conn = connect(database)
-    return conn
 
 # --- USER FUNCTIONS ---
 
 
 def get_all_users():
     """Get all users from database"""
-    conn = getprocessor()
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM user")
     rows = cursor.fetchall()
-    conn.close()
     return rows
 
 
 def get_user_by_id(user_id):
     """Get user by ID"""
-    conn = getprocessor()
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM user WHERE id = ?", (user_id,))
     user = cursor.fetchone()
-    conn.close()
     return user
 
 
+USER_BY_EMAIL_SQL = "SELECT * FROM user WHERE email = ?"
+
+
 def get_user_by_email(email):
-    """Get user by email"""
-    conn = getprocessor()
+    """Get user by email (cached; unknown emails are not)"""
+    user = _user_cache.get(email)
+    if user is not _MISSING:
+        return user
+    generation = _user_cache.generation
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM user WHERE email = ?", (email,))
+    cursor.execute(USER_BY_EMAIL_SQL, (email,))
     user = cursor.fetchone()
-    conn.close()
+    if user is not None:
+        _user_cache.put(email, user, generation)
     return user
 
 
 def add_user(user_data):
-    """Add new user"""
+    """Add new user (the password is stored hashed)"""
     try:
-        conn = postprocess()
+        password_hash = passwords.hash_password(user_data['password'])
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute(
             "INSERT INTO user (email, pass) VALUES (?, ?)",
-            (user_data['email'], user_data['password'])
+            (user_data['email'], password_hash)
         )
         conn.commit()
-        conn.close()
+        _user_cache.invalidate(user_data['email'])
         return True, "User added successfully"
     except Exception as e:
+        _rollback()
         return False, str(e)
 
 
 def update_user(user_id, user_data):
-    """Update user"""
+    """Update user (a new password is stored hashed)"""
     try:
-        conn = postprocess()
+        conn = get_connection()
         cursor = conn.cursor()
 
         if 'password' in user_data and user_data['password']:
+            password_hash = passwords.hash_password(user_data['password'])
             cursor.execute(
                 "UPDATE user SET email = ?, pass = ? WHERE id = ?",
-                (user_data['email'], user_data['password'], user_id)
+                (user_data['email'], password_hash, user_id)
             )
         else:
             cursor.execute(
@@ -126,61 +406,269 @@ def update_user(user_id, user_data):
             )
 
         conn.commit()
-        conn.close()
+        # The previous email is not known here, drop all cached users
+        _user_cache.invalidate()
         return True, "User updated successfully"
     except Exception as e:
+        _rollback()
         return False, str(e)
 
 
 def delete_user(user_id):
     """Delete user"""
     try:
-        conn = postprocess()
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("DELETE FROM user WHERE id = ?", (user_id,))
         conn.commit()
-        conn.close()
+        _user_cache.invalidate()
         return True, "User deleted successfully"
     except Exception as e:
+        _rollback()
         return False, str(e)
 
 
 def authenticate_user(email, password):
-    """Authenticate user"""
+    """Authenticate user
+
+    The password is checked on the passwords hashing pool, which raises
+    passwords.Busy when too many logins are waiting. A plaintext or
+    outdated stored password is replaced by a current hash on success.
+    """
     user = get_user_by_email(email)
-    if user:
-        if user['pass'] == password:
-            return True, user
-    return False, None
+    ok, new_hash = passwords.verify(password, user['pass'] if user else None)
+    if not ok:
+        return False, None
+    if new_hash:
+        _upgrade_password(user, new_hash)
+    return True, user
+
+
+def _upgrade_password(user, new_hash):
+    """Store a rehashed password unless it was changed meanwhile"""
+    try:
+        conn = get_connection()
+        conn.execute(
+            "UPDATE user SET pass = ? WHERE id = ? AND pass = ?",
+            (new_hash, user['id'], user['pass'])
+        )
+        conn.commit()
+        _user_cache.invalidate(user['email'])
+    except Exception as e:
+        # The login still succeeds; the upgrade is retried next time
+        _rollback()
+        print(f"Error upgrading password hash: {e}")
 
 # --- STUDENT FUNCTIONS ---
 
 
 def get_all():
     """Get all students"""
-    conn = getprocessor()
+    conn = get_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM student_account")
     rows = cursor.fetchall()
-    conn.close()
     return rows
 
 
+STUDENT_BY_ID_SQL = "SELECT * FROM student_account WHERE idno = ?"
+
+
 def get_student_by_id(student_id):
-    """Get student by ID (using idno)"""
-    conn = getprocessor()
+    """Get student by ID (using idno, cached)"""
+    student = _student_cache.get(student_id)
+    if student is not _MISSING:
+        return student
+    generation = _student_cache.generation
+    conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute(
-        "SELECT * FROM student_account WHERE idno = ?", (student_id,))
+    cursor.execute(STUDENT_BY_ID_SQL, (student_id,))
     student = cursor.fetchone()
-    conn.close()
+    _student_cache.put(student_id, student, generation)
     return student
 
 
+# Columns the student list can be sorted by
+STUDENT_SORT_COLUMNS = ('idno', 'Lastname', 'Firstname', 'course', 'level')
+MAX_PAGE_SIZE: int = 200
+
+
+def _encode_cursor(values):
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        raise ValueError("Invalid page cursor")
+    if (not isinstance(values, list) or len(values) != 2
+            or not all(isinstance(v, (str, int, float)) for v in values)):
+        raise ValueError("Invalid page cursor")
+    return values
+
+
+def get_students_page(search=None, course=None, level=None, sort='idno',
+                      order='asc', cursor=None, limit=50):
+    """Get one page of students using keyset pagination
+
+    Rows are ordered by (sort, idno); pass the returned next_cursor to get
+    the following page. total is only counted for the first page.
+    """
+    if sort not in STUDENT_SORT_COLUMNS:
+        raise ValueError(f"Cannot sort students by {sort!r}")
+    if order not in ('asc', 'desc'):
+        raise ValueError(f"Unknown sort order {order!r}")
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+    where = []
+    params = []
+    if search:
+        pattern = f"%{search}%"
+        where.append(
+            "(idno LIKE ? OR Lastname LIKE ? OR Firstname LIKE ? OR course LIKE ? OR level LIKE ?)")
+        params.extend([pattern] * 5)
+    if course:
+        where.append("course = ?")
+        params.append(course)
+    if level:
+        where.append("level = ?")
+        params.append(level)
+
+    conn = get_connection()
+    total = None
+    if cursor is None:
+        count_sql = "SELECT COUNT(*) FROM student_account"
+        if where:
+            count_sql += " WHERE " + " AND ".join(where)
+        total = conn.execute(count_sql, params).fetchone()[0]
+
+    direction = 'ASC' if order == 'asc' else 'DESC'
+    if cursor is not None:
+        where.append(f"({sort}, idno) {'>' if order == 'asc' else '<'} (?, ?)")
+        params.extend(_decode_cursor(cursor))
+
+    query = "SELECT * FROM student_account"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += f" ORDER BY {sort} {direction}, idno {direction} LIMIT ?"
+    # One extra row tells us whether another page exists
+    rows = conn.execute(query, params + [limit + 1]).fetchall()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = _encode_cursor([last[sort], last['idno']])
+
+    return {'students': rows, 'next_cursor': next_cursor, 'total': total}
+
+
+MAX_SEARCH_RESULTS: int = 100
+# Queries matching at least this many students are returned unranked
+RANK_CANDIDATES: int = 1000
+# Share of the query's trigrams a fuzzy match must contain
+FUZZY_MIN_SIMILARITY: float = 0.5
+
+
+def _trigrams(text):
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _fts_quote(token):
+    return '"' + token.replace('"', '""') + '"'
+
+
+def search_students(query, limit=20):
+    """Full-text search over students ranked by bm25
+
+    Every word must prefix-match some column. When nothing matches,
+    typo-tolerant trigram matches are returned instead.
+    Returns (rows, fuzzy) where fuzzy is True if trigram matches were used.
+    """
+    limit = max(1, min(int(limit), MAX_SEARCH_RESULTS))
+    words = re.findall(r'\w+', query or '')
+    if not words:
+        return [], False
+
+    conn = get_connection()
+    match = ' AND '.join(_fts_quote(word) + '*' for word in words)
+    # bm25 has to score every match; for very broad queries ("bsit") the
+    # ranking is meaningless and costly, so take the first matches instead
+    matches = conn.execute(STUDENT_SEARCH_PROBE_SQL,
+                           (match, RANK_CANDIDATES)).fetchone()[0]
+    search_sql = STUDENT_SEARCH_SQL if matches < RANK_CANDIDATES else STUDENT_SEARCH_UNRANKED_SQL
+    rows = conn.execute(search_sql, (match, limit)).fetchall()
+    if rows:
+        return rows, False
+
+    # Fuzzy pass for likely typos: any shared trigram is a candidate, keep
+    # the close ones. ID numbers are never fuzzy-matched.
+    grams = set()
+    for word in words:
+        if not word.isdigit():
+            grams |= _trigrams(word)
+    if not grams:
+        return rows, False
+
+    match = ' OR '.join(_fts_quote(gram) for gram in sorted(grams))
+    candidates = conn.execute(
+        STUDENT_FUZZY_SEARCH_SQL, (match, limit * 3)).fetchall()
+
+    fuzzy = False
+    for row in candidates:
+        if len(rows) >= limit:
+            break
+        text = ' '.join(str(row[col]) for col in ('idno', 'Lastname', 'Firstname', 'course', 'level'))
+        doc_grams = set()
+        for word in re.findall(r'\w+', text):
+            doc_grams |= _trigrams(word)
+        if len(grams & doc_grams) / len(grams) >= FUZZY_MIN_SIMILARITY:
+            rows.append(row)
+            fuzzy = True
+    return rows, fuzzy
+
+
+STUDENT_SEARCH_PROBE_SQL = """
+    SELECT COUNT(*) FROM (
+        SELECT rowid FROM student_fts WHERE student_fts MATCH ? LIMIT ?
+    )
+"""
+
+STUDENT_SEARCH_UNRANKED_SQL = """
+    SELECT s.*
+    FROM student_fts
+    JOIN student_account s ON s.id = student_fts.rowid
+    WHERE student_fts MATCH ?
+    LIMIT ?
+"""
+
+STUDENT_SEARCH_SQL = """
+    SELECT s.*
+    FROM student_fts
+    JOIN student_account s ON s.id = student_fts.rowid
+    WHERE student_fts MATCH ?
+    ORDER BY bm25(student_fts)
+    LIMIT ?
+"""
+
+STUDENT_FUZZY_SEARCH_SQL = """
+    SELECT s.*
+    FROM student_fts_trigram
+    JOIN student_account s ON s.id = student_fts_trigram.rowid
+    WHERE student_fts_trigram MATCH ?
+    ORDER BY bm25(student_fts_trigram)
+    LIMIT ?
+"""
+
+
 def add_record(student_data):
     """Add new student"""
     try:
-        conn = postprocess()
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute(
             "INSERT INTO student_account (idno, Lastname, Firstname, course, level, image) VALUES (?, ?, ?, ?, ?, ?)",
@@ -194,16 +682,117 @@ def add_record(student_data):
             )
         )
         conn.commit()
-        conn.close()
+        _student_cache.invalidate(student_data['idno'])
         return True, "Student added successfully"
     except Exception as e:
+        _rollback()
         return False, str(e)
 
 
+# Rows inserted per transaction by import_students()
+IMPORT_CHUNK_SIZE: int = 1000
+IMPORT_FIELDS = ('idno', 'Lastname', 'Firstname', 'course', 'level')
+
+
+def _import_chunk(conn, chunk, report):
+    """Insert one chunk of validated rows, reporting rows that fail"""
+    cursor = conn.cursor()
+    idnos = [row['idno'] for _, row in chunk]
+    cursor.execute(
+        f"SELECT idno FROM student_account WHERE idno IN ({', '.join('?' * len(idnos))})",
+        idnos
+    )
+    existing = {row[0] for row in cursor.fetchall()}
+
+    values = []
+    for line, row in chunk:
+        if row['idno'] in existing:
+            report['errors'].append(
+                {'line': line, 'idno': row['idno'], 'message': 'Student ID already exists'})
+            continue
+        values.append((line, row))
+
+    insert_sql = "INSERT INTO student_account (idno, Lastname, Firstname, course, level, image) VALUES (?, ?, ?, ?, ?, ?)"
+    params = [tuple(row[field] for field in IMPORT_FIELDS) + (row.get('image'),)
+              for _, row in values]
+    try:
+        cursor.executemany(insert_sql, params)
+        conn.commit()
+        for _, row in values:
+            _student_cache.invalidate(row['idno'])
+        report['inserted'].extend(row['idno'] for _, row in values)
+    except Exception:
+        # Something in the chunk raced or broke a constraint: retry row by
+        # row so only the offending rows are reported
+        conn.rollback()
+        for (line, row), param in zip(values, params):
+            try:
+                cursor.execute(insert_sql, param)
+                conn.commit()
+                _student_cache.invalidate(row['idno'])
+                report['inserted'].append(row['idno'])
+            except Exception as e:
+                conn.rollback()
+                report['errors'].append(
+                    {'line': line, 'idno': row['idno'], 'message': str(e)})
+
+
+def import_students(rows, images=None, chunk_size=None):
+    """Bulk insert students from CSV-style dicts in chunked transactions
+
+    Column names are matched case-insensitively (idno, lastname, firstname,
+    course, level, optional image). images maps idno to an image path and
+    overrides the image column. Returns a report with the inserted idnos,
+    per-line errors (the header is line 1) and throughput.
+    """
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    images = images or {}
+    report = {'inserted': [], 'errors': [], 'rows': 0}
+    started = time.perf_counter()
+    seen = set()
+    chunk = []
+
+    try:
+        conn = get_connection()
+        for line, raw in enumerate(rows, start=2):
+            report['rows'] += 1
+            lowered = {(key or '').strip().lower(): (value or '').strip()
+                       for key, value in raw.items() if isinstance(value, str)}
+            row = {field: lowered.get(field.lower(), '') for field in IMPORT_FIELDS}
+            row['image'] = images.get(row['idno']) or lowered.get('image') or None
+
+            missing = [field for field in IMPORT_FIELDS if not row[field]]
+            if missing:
+                report['errors'].append({'line': line, 'idno': row['idno'],
+                                         'message': f"Missing {', '.join(missing)}"})
+                continue
+            if row['idno'] in seen:
+                report['errors'].append({'line': line, 'idno': row['idno'],
+                                         'message': 'Duplicate Student ID in file'})
+                continue
+            seen.add(row['idno'])
+
+            chunk.append((line, row))
+            if len(chunk) >= chunk_size:
+                _import_chunk(conn, chunk, report)
+                chunk = []
+        if chunk:
+            _import_chunk(conn, chunk, report)
+    except Exception as e:
+        _rollback()
+        report['errors'].append({'line': None, 'idno': None, 'message': str(e)})
+
+    elapsed = time.perf_counter() - started
+    report['errors'].sort(key=lambda error: (error['line'] is None, error['line'] or 0))
+    report['seconds'] = round(elapsed, 3)
+    report['rows_per_second'] = round(report['rows'] / elapsed) if elapsed else None
+    return report
+
+
 def update_record(student_idno, student_data):
     """Update student by idno - FIXED: Now includes image update"""
     try:
-        conn = postprocess()
+        conn = get_connection()
         cursor = conn.cursor()
 
         # FIXED: Include image in update
@@ -219,33 +808,175 @@ def update_record(student_idno, student_data):
             )
         )
         conn.commit()
-        conn.close()
+        _student_cache.invalidate(student_idno)
         return True, "Student updated successfully"
     except Exception as e:
+        _rollback()
         return False, str(e)
 
 
+# Largest page of roster changes
+MAX_ROSTER_PAGE: int = 5000
+
+# Roster entries for scanner kiosks, with the thumbnail variant if there is one
+ROSTER_SQL = """
+    SELECT s.change_seq, s.idno, s.Lastname, s.Firstname, s.course, s.level,
+           s.image, v.path AS thumb
+    FROM student_account s
+    LEFT JOIN photo_variant v ON v.image = s.image AND v.size = 'thumb'
+    WHERE s.change_seq > ? AND s.change_seq <= ?
+    ORDER BY s.change_seq
+    LIMIT ?
+"""
+
+ROSTER_TOMBSTONE_SQL = """
+    SELECT idno FROM student_tombstone WHERE change_seq > ? AND change_seq <= ?
+"""
+
+
+def get_roster_changes(since=0, limit=MAX_ROSTER_PAGE):
+    """Get students changed or deleted after the `since` roster version
+
+    Returns (students, deleted idnos, version, more). since=0 gives the
+    full roster. Ask again from `version` while more is True.
+    """
+    limit = max(1, min(limit, MAX_ROSTER_PAGE))
+    conn = get_connection()
+    version = get_change_versions(STUDENT_SEQ_SCOPE)[STUDENT_SEQ_SCOPE]
+    students = conn.execute(ROSTER_SQL, (since, version, limit)).fetchall()
+
+    more = len(students) == limit
+    if more:
+        # Students sharing a photo can share a sequence number: finish
+        # that number so the next page can start strictly after it
+        version = students[-1]['change_seq']
+        students = [row for row in students if row['change_seq'] < version]
+        students += conn.execute(ROSTER_SQL, (version - 1, version, -1)).fetchall()
+
+    deleted = [row[0] for row in conn.execute(ROSTER_TOMBSTONE_SQL, (since, version))]
+    return students, deleted, version, more
+
+
+def set_student_image(student_idno, image, expected):
+    """Set a student's image only while it is still `expected` (returns True if changed)"""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE student_account SET image = ? WHERE idno = ? AND image IS ?",
+            (image, student_idno, expected)
+        )
+        conn.commit()
+        _student_cache.invalidate(student_idno)
+        return cursor.rowcount > 0
+    except Exception as e:
+        _rollback()
+        print(f"Error updating student image: {e}")
+        return False
+
+
+PHOTO_VARIANTS_SQL = "SELECT size, path, width, height, bytes FROM photo_variant WHERE image = ?"
+
+
+def get_photo_variants(image):
+    """Get {size: variant row} of a stored photo (cached)"""
+    variants = _variant_cache.get(image)
+    if variants is not _MISSING:
+        return dict(variants)
+    generation = _variant_cache.generation
+    conn = get_connection()
+    variants = {row['size']: row for row in conn.execute(PHOTO_VARIANTS_SQL, (image,))}
+    _variant_cache.put(image, variants, generation)
+    return dict(variants)
+
+
+def save_photo_variants(image, variants):
+    """Replace the variants of a photo, `variants` maps size to (path, width, height, bytes)"""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM photo_variant WHERE image = ?", (image,))
+        cursor.executemany(
+            "INSERT INTO photo_variant (image, size, path, width, height, bytes) VALUES (?, ?, ?, ?, ?, ?)",
+            [(image, size) + tuple(variant) for size, variant in variants.items()]
+        )
+        conn.commit()
+        _variant_cache.invalidate(image)
+        return True, "Photo variants saved"
+    except Exception as e:
+        _rollback()
+        return False, str(e)
+
+
+def delete_photo_variants(image):
+    """Forget the variants of a photo, returns their paths"""
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        paths = [row[0] for row in cursor.execute(
+            "SELECT path FROM photo_variant WHERE image = ?", (image,))]
+        cursor.execute("DELETE FROM photo_variant WHERE image = ?", (image,))
+        conn.commit()
+        _variant_cache.invalidate(image)
+        return paths
+    except Exception as e:
+        _rollback()
+        print(f"Error deleting photo variants: {e}")
+        return []
+
+
+IMAGE_REFS_SQL = "SELECT COUNT(*) FROM student_account WHERE image = ?"
+
+
+def count_image_refs(image):
+    """Count students whose photo is `image`"""
+    conn = get_connection()
+    return conn.execute(IMAGE_REFS_SQL, (image,)).fetchone()[0]
+
+
+def get_referenced_images():
+    """Get every photo some student refers to"""
+    conn = get_connection()
+    rows = conn.execute(
+        "SELECT DISTINCT image FROM student_account WHERE image IS NOT NULL AND image != ''")
+    return [row[0] for row in rows]
+
+
+def get_variant_images():
+    """Get every photo that has variants recorded"""
+    conn = get_connection()
+    return [row[0] for row in conn.execute("SELECT DISTINCT image FROM photo_variant")]
+
+
+def get_images_without_variants():
+    """Get student photos that have no variants yet"""
+    conn = get_connection()
+    rows = conn.execute("""
+        SELECT DISTINCT s.image FROM student_account s
+        WHERE s.image IS NOT NULL AND s.image != ''
+          AND NOT EXISTS (SELECT 1 FROM photo_variant v WHERE v.image = s.image)
+    """).fetchall()
+    return [row[0] for row in rows]
+
+
 def delete_record(student_idno):
     """Delete student by idno"""
     try:
-        conn = postprocess()
+        conn = get_connection()
         cursor = conn.cursor()
         cursor.execute(
             "DELETE FROM student_account WHERE idno = ?", (student_idno,))
         conn.commit()
-        conn.close()
+        _student_cache.invalidate(student_idno)
         return True, "Student deleted successfully"
     except Exception as e:
+        _rollback()
         return False, str(e)
 
 # --- ATTENDANCE FUNCTIONS ---
 
 
-def get_attendance_by_date(date):
-    """Get all attendance records for a specific date with student info"""
-    conn = getprocessor()
-    cursor = conn.cursor()
-    cursor.execute("""
+ATTENDANCE_BY_DATE_SQL = """
         SELECT 
             s.idno,
             s.Lastname,
@@ -258,119 +989,389 @@ def get_attendance_by_date(date):
         FROM student_account s
         LEFT JOIN attendance a ON s.idno = a.student_idno AND a.date = ?
         ORDER BY s.Lastname, s.Firstname
-    """, (date,))
+    """
+
+
+def get_attendance_by_date(date):
+    """Get all attendance records for a specific date with student info"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(ATTENDANCE_BY_DATE_SQL, (date,))
     rows = cursor.fetchall()
-    conn.close()
     return rows
 
 
-def mark_attendance(student_idno, date, time_in, status):
-    """Mark or update attendance for a student"""
+# Columns of attendance exports, in order
+EXPORT_COLUMNS = ('date', 'student_idno', 'Lastname', 'Firstname', 'course',
+                  'level', 'time_in', 'time_out', 'status')
+
+# Ordered to follow idx_attendance_date_status so no sort is needed
+ATTENDANCE_RANGE_SQL = """
+    SELECT
+        a.date,
+        a.student_idno,
+        s.Lastname,
+        s.Firstname,
+        s.course,
+        s.level,
+        a.time_in,
+        a.time_out,
+        a.status
+    FROM attendance a
+    LEFT JOIN student_account s ON s.idno = a.student_idno
+    WHERE a.date BETWEEN ? AND ?
+    ORDER BY a.date, a.status, a.student_idno
+"""
+
+
+# Largest page of the changes feed
+MAX_CHANGES: int = 1000
+
+# Follows idx_attendance_date_seq, so the cost grows with the number of
+# changes rather than the number of students
+ATTENDANCE_CHANGES_SQL = """
+    SELECT
+        a.change_seq,
+        s.idno,
+        s.Lastname,
+        s.Firstname,
+        s.course,
+        s.level,
+        COALESCE(a.time_in, '') as time_in,
+        COALESCE(a.time_out, '') as time_out,
+        a.status
+    FROM attendance a
+    JOIN student_account s ON s.idno = a.student_idno
+    WHERE a.date = ? AND a.change_seq > ?
+    ORDER BY a.change_seq
+    LIMIT ?
+"""
+
+
+def get_attendance_cursor():
+    """Get the latest attendance change sequence number"""
+    return get_change_versions(ATTENDANCE_SEQ_SCOPE)[ATTENDANCE_SEQ_SCOPE]
+
+
+def get_attendance_changes(date, since, limit=MAX_CHANGES):
+    """Get attendance rows of a date changed after the `since` cursor
+
+    Returns (rows, cursor, more): cursor is the sequence number to ask
+    from next time, more is True when rows stopped at the limit.
+    """
+    limit = max(1, min(limit, MAX_CHANGES))
+    conn = get_connection()
+    rows = conn.execute(ATTENDANCE_CHANGES_SQL, (date, since, limit)).fetchall()
+    cursor = rows[-1]['change_seq'] if rows else since
+    return rows, cursor, len(rows) == limit
+
+
+def iter_attendance_range(date_from, date_to, batch_size=500):
+    """Yield attendance rows between two dates (inclusive) in fetchmany batches"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(ATTENDANCE_RANGE_SQL, (date_from, date_to))
     try:
-        conn = postprocess()
-        cursor = conn.cursor()
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
 
-        cursor.execute(
-            "SELECT id FROM attendance WHERE student_idno = ? AND date = ?",
-            (student_idno, date)
-        )
-        existing = cursor.fetchone()
 
-        if existing:
-            cursor.execute(
-                "UPDATE attendance SET time_in = ?, status = ? WHERE student_idno = ? AND date = ?",
-                (time_in, status, student_idno, date)
-            )
-        else:
-            cursor.execute(
-                "INSERT INTO attendance (student_idno, date, time_in, status) VALUES (?, ?, ?, ?)",
-                (student_idno, date, time_in, status)
-            )
+ATTENDANCE_RECORD_SQL = """
+    SELECT date, time_in, time_out, status FROM attendance
+    WHERE student_idno = ? AND date = ?
+"""
 
-        conn.commit()
-        conn.close()
-        return True, "Attendance marked successfully"
+
+def get_attendance_record(student_idno, date):
+    """Get one student's attendance row for a date (None if not marked)"""
+    conn = get_connection()
+    return conn.execute(ATTENDANCE_RECORD_SQL, (student_idno, date)).fetchone()
+
+
+def _upsert_attendance(insert_sql, update_sql, insert_params, update_params):
+    """Insert an attendance row, or update it if one exists for the student and date
+
+    Returns True if a new row was created. Both statements run in one
+    transaction: the insert takes the write lock, so no other writer can
+    add the row in between. (A single ON CONFLICT DO UPDATE can't report
+    which branch it took: it advances the AUTOINCREMENT counter either
+    way, and last_insert_rowid() is shared with every other table.)
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(insert_sql, insert_params)
+    created = cursor.rowcount == 1
+    if not created:
+        cursor.execute(update_sql, update_params)
+    conn.commit()
+    return created
+
+
+def mark_attendance(student_idno, date, time_in, status):
+    """Mark or update attendance for a student, returns (success, message, created)"""
+    try:
+        created = _upsert_attendance("""
+            INSERT INTO attendance (student_idno, date, time_in, status)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(student_idno, date) DO NOTHING
+        """, """
+            UPDATE attendance SET time_in = ?, status = ?
+            WHERE student_idno = ? AND date = ?
+        """, (student_idno, date, time_in, status), (time_in, status, student_idno, date))
+        return True, "Attendance marked successfully", created
     except Exception as e:
-        return False, str(e)
+        _rollback()
+        return False, str(e), False
 
 
 def update_attendance_status(student_idno, date, status, time_in=None, time_out=None):
-    """Update attendance status and optionally time in/out"""
+    """Update attendance status and optionally time in/out, returns (success, message, created)"""
+    time_in, time_out = time_in or None, time_out or None
     try:
-        conn = postprocess()
-        cursor = conn.cursor()
+        # Empty times leave the stored value alone
+        created = _upsert_attendance("""
+            INSERT INTO attendance (student_idno, date, status, time_in, time_out)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(student_idno, date) DO NOTHING
+        """, """
+            UPDATE attendance SET
+                status = ?,
+                time_in = COALESCE(?, time_in),
+                time_out = COALESCE(?, time_out)
+            WHERE student_idno = ? AND date = ?
+        """, (student_idno, date, status, time_in, time_out),
+            (status, time_in, time_out, student_idno, date))
+        return True, "Attendance updated successfully", created
+    except Exception as e:
+        _rollback()
+        return False, str(e), False
 
-        cursor.execute(
-            "SELECT id FROM attendance WHERE student_idno = ? AND date = ?",
-            (student_idno, date)
-        )
-        existing = cursor.fetchone()
-
-        if existing:
-            if time_in and time_out:
-                cursor.execute(
-                    "UPDATE attendance SET status = ?, time_in = ?, time_out = ? WHERE student_idno = ? AND date = ?",
-                    (status, time_in, time_out, student_idno, date)
-                )
-            elif time_in:
-                cursor.execute(
-                    "UPDATE attendance SET status = ?, time_in = ? WHERE student_idno = ? AND date = ?",
-                    (status, time_in, student_idno, date)
-                )
-            elif time_out:
-                cursor.execute(
-                    "UPDATE attendance SET status = ?, time_out = ? WHERE student_idno = ? AND date = ?",
-                    (status, time_out, student_idno, date)
-                )
-            else:
-                cursor.execute(
-                    "UPDATE attendance SET status = ? WHERE student_idno = ? AND date = ?",
-                    (status, student_idno, date)
-                )
+
+def mark_attendance_batch(scans):
+    """Mark attendance for many scans in one transaction
+
+    Each scan is a dict with student_idno, date, time_in, optional status
+    and optional idempotency_key. Scans whose key was already applied are
+    reported as duplicates and skipped. Returns (success, message, results)
+    with one result per scan, in order.
+    """
+    results = []
+    pending = []
+    seen_keys = set()
+
+    for index, scan in enumerate(scans):
+        scan = scan if isinstance(scan, dict) else {}
+        key = scan.get('idempotency_key')
+        if key is not None:
+            key = scan['idempotency_key'] = str(key)
+        result = {'index': index, 'idempotency_key': key}
+        results.append(result)
+
+        if not scan.get('student_idno') or not scan.get('date') or not scan.get('time_in'):
+            result.update(status='invalid', message='Missing required fields')
+        elif key is not None and key in seen_keys:
+            result.update(status='duplicate', message='Repeated in batch')
         else:
+            if key is not None:
+                seen_keys.add(key)
+            pending.append((result, scan))
+
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        # Look up keys applied by earlier requests
+        keys = list(seen_keys)
+        applied = set()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
             cursor.execute(
-                "INSERT INTO attendance (student_idno, date, status, time_in) VALUES (?, ?, ?, ?)",
-                (student_idno, date, status, time_in)
+                f"SELECT idempotency_key FROM scan_key WHERE idempotency_key IN ({', '.join('?' * len(chunk))})",
+                chunk
             )
+            applied.update(row[0] for row in cursor.fetchall())
+
+        rows = []
+        key_rows = []
+        received_at = datetime.now().isoformat(timespec='seconds')
+        for result, scan in pending:
+            key = scan.get('idempotency_key')
+            if key in applied:
+                result.update(status='duplicate', message='Already applied')
+                continue
+            rows.append((scan['student_idno'], scan['date'],
+                         scan['time_in'], scan.get('status') or 'PRESENT'))
+            if key is not None:
+                key_rows.append(
+                    (key, scan['student_idno'], scan['date'], received_at))
+            result.update(status='applied', message='Attendance marked')
 
+        cursor.executemany("""
+            INSERT INTO attendance (student_idno, date, time_in, status)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(student_idno, date) DO UPDATE SET
+                time_in = excluded.time_in,
+                status = excluded.status
+        """, rows)
+        cursor.executemany(
+            "INSERT INTO scan_key (idempotency_key, student_idno, date, received_at) VALUES (?, ?, ?, ?)",
+            key_rows
+        )
         conn.commit()
-        conn.close()
-        return True, "Attendance updated successfully"
+        return True, f"{len(rows)} scans applied", results
     except Exception as e:
-        return False, str(e)
+        _rollback()
+        for result, scan in pending:
+            result.update(status='error', message=str(e))
+        return False, str(e), results
 
 
-def get_attendance_stats(date):
-    """Get attendance statistics for a specific date"""
-    conn = getprocessor()
-    cursor = conn.cursor()
+# Columns get_attendance_stats() can break the counts down by
+STATS_GROUPS = ('course', 'level')
 
-    cursor.execute("SELECT COUNT(*) as total FROM student_account")
-    total = cursor.fetchone()['total']
+# One aggregate over the date's range of idx_attendance_date_status. Only
+# rows of existing students count, as in the grouped query's join, so the
+# groups add up to these totals
+ATTENDANCE_STATS_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM student_account) AS total,
+        COALESCE(SUM(CASE WHEN a.status = 'PRESENT' THEN 1 END), 0) AS present,
+        COALESCE(SUM(CASE WHEN a.status = 'LATE' THEN 1 END), 0) AS late
+    FROM attendance a
+    WHERE a.date = ? AND a.status IN ('PRESENT', 'LATE')
+      AND EXISTS (SELECT 1 FROM student_account s WHERE s.idno = a.student_idno)
+"""
 
-    cursor.execute(
-        "SELECT COUNT(*) as count FROM attendance WHERE date = ? AND status = 'PRESENT'",
-        (date,)
-    )
-    present = cursor.fetchone()['count']
-
-    cursor.execute(
-        "SELECT COUNT(*) as count FROM attendance WHERE date = ? AND status = 'LATE'",
-        (date,)
-    )
-    late = cursor.fetchone()['count']
+ATTENDANCE_STATS_GROUPED_SQL = """
+    SELECT
+        s.{group} AS grp,
+        COUNT(*) AS total,
+        COALESCE(SUM(a.status = 'PRESENT'), 0) AS present,
+        COALESCE(SUM(a.status = 'LATE'), 0) AS late
+    FROM student_account s
+    LEFT JOIN attendance a ON s.idno = a.student_idno AND a.date = ?
+    GROUP BY s.{group}
+    ORDER BY s.{group}
+"""
 
-    absent = total - present - late
-
-    conn.close()
 
+def _stats_dict(total, present, late):
     return {
         'total': total,
         'present': present,
         'late': late,
-        'absent': absent
+        'absent': total - present - late
     }
 
 
-# Initialize DB on first run
-init_db()
+def get_attendance_stats(date, group_by=None):
+    """Get attendance statistics for a specific date in one query
+
+    With group_by set to 'course' or 'level' a list of per-group stats is
+    returned instead, each with the group value under that key.
+    """
+    if group_by is not None and group_by not in STATS_GROUPS:
+        raise ValueError(f"Cannot group attendance stats by {group_by!r}")
+
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    if not group_by:
+        cursor.execute(ATTENDANCE_STATS_SQL, (date,))
+        row = cursor.fetchone()
+        return _stats_dict(row['total'], row['present'], row['late'])
+
+    cursor.execute(
+        ATTENDANCE_STATS_GROUPED_SQL.format(group=group_by), (date,))
+
+    breakdown = []
+    for row in cursor.fetchall():
+        stats = _stats_dict(row['total'], row['present'], row['late'])
+        stats[group_by] = row['grp']
+        breakdown.append(stats)
+    return breakdown
+
+
+# --- CHANGE COUNTERS ---
+
+# Bumped by triggers (migration 5) on every student_account change and on
+# every attendance change per date, so they also see writes made by other
+# processes. Used as ETags by the JSON APIs.
+STUDENT_SCOPE = 'student_account'
+# Global sequence stamped on attendance rows (migration 6)
+ATTENDANCE_SEQ_SCOPE = 'attendance_seq'
+# Global sequence stamped on students, with tombstones for deletes (migration 9)
+STUDENT_SEQ_SCOPE = 'student_seq'
+
+CHANGE_VERSION_SQL = "SELECT scope, version FROM change_counter WHERE scope IN ({marks})"
+
+
+def attendance_scope(date):
+    """Change counter scope of one attendance date"""
+    return f"attendance:{date}"
+
+
+def get_change_versions(*scopes):
+    """Get {scope: version} for the given scopes (0 for never changed)"""
+    conn = get_connection()
+    marks = ', '.join('?' * len(scopes))
+    rows = conn.execute(CHANGE_VERSION_SQL.format(marks=marks), scopes).fetchall()
+    versions = dict.fromkeys(scopes, 0)
+    versions.update((row['scope'], row['version']) for row in rows)
+    return versions
+
+
+# --- QUERY PLAN AUDIT ---
+
+# Hot queries and sample parameters, checked by check_query_plans()
+HOT_QUERIES = {
+    'get_user_by_email': (USER_BY_EMAIL_SQL, ('',)),
+    'get_student_by_id': (STUDENT_BY_ID_SQL, ('',)),
+    'get_attendance_by_date': (ATTENDANCE_BY_DATE_SQL, ('',)),
+    'get_attendance_record': (ATTENDANCE_RECORD_SQL, ('', '')),
+    'get_attendance_stats': (ATTENDANCE_STATS_SQL, ('',)),
+    'get_attendance_stats[course]': (ATTENDANCE_STATS_GROUPED_SQL.format(group='course'), ('',)),
+    'get_attendance_stats[level]': (ATTENDANCE_STATS_GROUPED_SQL.format(group='level'), ('',)),
+    'get_students_page[Lastname]': (
+        "SELECT * FROM student_account WHERE (Lastname, idno) > (?, ?) ORDER BY Lastname ASC, idno ASC LIMIT ?",
+        ('', '', 50)),
+    'iter_attendance_range': (ATTENDANCE_RANGE_SQL, ('', '')),
+    'get_attendance_changes': (ATTENDANCE_CHANGES_SQL, ('', 0, 1)),
+    'get_photo_variants': (PHOTO_VARIANTS_SQL, ('',)),
+    'count_image_refs': (IMAGE_REFS_SQL, ('',)),
+    'get_roster_changes': (ROSTER_SQL, (0, 0, 1)),
+    'get_roster_changes[deleted]': (ROSTER_TOMBSTONE_SQL, (0, 0)),
+    'get_change_versions': (CHANGE_VERSION_SQL.format(marks='?, ?'), ('', '')),
+    'scan_key lookup': ("SELECT idempotency_key FROM scan_key WHERE idempotency_key IN (?)", ('',)),
+}
+
+
+def explain(sql, params=()):
+    """Get the EXPLAIN QUERY PLAN detail lines for a query"""
+    conn = get_connection()
+    return [row['detail'] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def check_query_plans():
+    """Return {query name: [offending plan lines]} for hot queries that full-scan or sort"""
+    problems = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        bad = []
+        for detail in explain(sql, params):
+            full_scan = (detail.startswith('SCAN') and ' USING ' not in detail
+                         and detail != 'SCAN CONSTANT ROW')
+            if full_scan or 'TEMP B-TREE' in detail:
+                bad.append(detail)
+        if bad:
+            problems[name] = bad
+    return problems
+
+
+# Registered before the attendance writer and photo pool (imported after
+# this module) so it runs after they have drained: the WAL is truncated last
+atexit.register(close_all_connections)
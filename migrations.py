@@ -0,0 +1,497 @@
+"""Numbered schema migrations for db/Campus.db
+
+Each migration is a version number, a description and a list of steps:
+
+    sql(statement, table)           DDL or a small statement, run in one transaction
+    add_column(table, column, decl) ALTER TABLE ... ADD COLUMN, skipped if present
+    backfill(table, assignments, where)
+                                    UPDATE in batches of BATCH_SIZE rows, committing
+                                    between batches so scanners are never locked out
+                                    for long. `where` must stop matching a row once
+                                    it has been updated, which also makes the
+                                    backfill resumable.
+
+Steps must be safe to re-run: a migration is only recorded in schema_version
+once all of its steps finished.
+
+A run holds the migration_lock row, so processes starting together (one
+per server worker) apply each migration once: the others wait, re-read
+the version and skip what was applied meanwhile.
+"""
+import os
+import time
+import uuid
+from datetime import datetime
+from sqlite3 import OperationalError
+
+BATCH_SIZE: int = 1000
+LOCK_TIMEOUT: int = 600     # seconds to wait for a run in another process
+LOCK_STALE: int = 120       # a lock not refreshed for this long belongs to a crashed run
+
+
+def sql(statement, table=None):
+    return {'kind': 'sql', 'sql': statement, 'table': table}
+
+
+def add_column(table, column, decl):
+    return {'kind': 'add_column', 'table': table, 'column': column, 'decl': decl}
+
+
+def backfill(table, assignments, where, batch_size=None):
+    return {'kind': 'backfill', 'table': table, 'assignments': assignments,
+            'where': where, 'batch_size': batch_size or BATCH_SIZE}
+
+
+MIGRATIONS = [
+    (1, "scan_key table for batch ingestion idempotency keys", [
+        sql("""
+            CREATE TABLE IF NOT EXISTS scan_key (
+                idempotency_key TEXT PRIMARY KEY,
+                student_idno TEXT NOT NULL,
+                date DATE NOT NULL,
+                received_at TEXT NOT NULL
+            )
+        """),
+    ]),
+    (2, "indexes for hot attendance and student lookups", [
+        sql("CREATE INDEX IF NOT EXISTS idx_user_email ON user(email)", 'user'),
+        sql("CREATE INDEX IF NOT EXISTS idx_attendance_date_status ON attendance(date, status, student_idno)", 'attendance'),
+        sql("CREATE INDEX IF NOT EXISTS idx_student_name ON student_account(Lastname, Firstname)", 'student_account'),
+        sql("CREATE INDEX IF NOT EXISTS idx_student_course ON student_account(course, idno)", 'student_account'),
+        sql("CREATE INDEX IF NOT EXISTS idx_student_level ON student_account(level, idno)", 'student_account'),
+    ]),
+    (3, "keyset pagination indexes for the student list", [
+        sql("CREATE INDEX IF NOT EXISTS idx_student_lastname_idno ON student_account(Lastname, idno)", 'student_account'),
+        sql("CREATE INDEX IF NOT EXISTS idx_student_firstname_idno ON student_account(Firstname, idno)", 'student_account'),
+    ]),
+    (4, "full-text search over students (FTS5) kept in sync by triggers", [
+        # Word/prefix index
+        sql("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS student_fts USING fts5(
+                idno, Lastname, Firstname, course, level,
+                content='student_account', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='1 2 3'
+            )
+        """),
+        # Trigram index for typo-tolerant matching
+        sql("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS student_fts_trigram USING fts5(
+                idno, Lastname, Firstname, course, level,
+                content='student_account', content_rowid='id',
+                tokenize='trigram'
+            )
+        """),
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS student_fts_ai AFTER INSERT ON student_account BEGIN
+                INSERT INTO student_fts (rowid, idno, Lastname, Firstname, course, level)
+                VALUES (new.id, new.idno, new.Lastname, new.Firstname, new.course, new.level);
+                INSERT INTO student_fts_trigram (rowid, idno, Lastname, Firstname, course, level)
+                VALUES (new.id, new.idno, new.Lastname, new.Firstname, new.course, new.level);
+            END
+        """),
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS student_fts_ad AFTER DELETE ON student_account BEGIN
+                INSERT INTO student_fts (student_fts, rowid, idno, Lastname, Firstname, course, level)
+                VALUES ('delete', old.id, old.idno, old.Lastname, old.Firstname, old.course, old.level);
+                INSERT INTO student_fts_trigram (student_fts_trigram, rowid, idno, Lastname, Firstname, course, level)
+                VALUES ('delete', old.id, old.idno, old.Lastname, old.Firstname, old.course, old.level);
+            END
+        """),
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS student_fts_au AFTER UPDATE ON student_account BEGIN
+                INSERT INTO student_fts (student_fts, rowid, idno, Lastname, Firstname, course, level)
+                VALUES ('delete', old.id, old.idno, old.Lastname, old.Firstname, old.course, old.level);
+                INSERT INTO student_fts (rowid, idno, Lastname, Firstname, course, level)
+                VALUES (new.id, new.idno, new.Lastname, new.Firstname, new.course, new.level);
+                INSERT INTO student_fts_trigram (student_fts_trigram, rowid, idno, Lastname, Firstname, course, level)
+                VALUES ('delete', old.id, old.idno, old.Lastname, old.Firstname, old.course, old.level);
+                INSERT INTO student_fts_trigram (rowid, idno, Lastname, Firstname, course, level)
+                VALUES (new.id, new.idno, new.Lastname, new.Firstname, new.course, new.level);
+            END
+        """),
+        # Index the students that already exist
+        sql("INSERT INTO student_fts (student_fts) VALUES ('rebuild')", 'student_account'),
+        sql("INSERT INTO student_fts_trigram (student_fts_trigram) VALUES ('rebuild')", 'student_account'),
+    ]),
+    (5, "change counters per table and per attendance date (ETags)", [
+        sql("""
+            CREATE TABLE IF NOT EXISTS change_counter (
+                scope TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            )
+        """),
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS change_student_ai AFTER INSERT ON student_account BEGIN
+                INSERT INTO change_counter (scope, version) VALUES ('student_account', 1)
+                ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+            END
+        """),
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS change_student_au AFTER UPDATE ON student_account BEGIN
+                INSERT INTO change_counter (scope, version) VALUES ('student_account', 1)
+                ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+            END
+        """),
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS change_student_ad AFTER DELETE ON student_account BEGIN
+                INSERT INTO change_counter (scope, version) VALUES ('student_account', 1)
+                ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+            END
+        """),
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS change_attendance_ai AFTER INSERT ON attendance BEGIN
+                INSERT INTO change_counter (scope, version) VALUES ('attendance:' || new.date, 1)
+                ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+            END
+        """),
+        # Repeated scans that leave the row as it was do not count as a change
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS change_attendance_au AFTER UPDATE ON attendance
+            WHEN old.date IS NOT new.date OR old.student_idno IS NOT new.student_idno
+                OR old.status IS NOT new.status OR old.time_in IS NOT new.time_in
+                OR old.time_out IS NOT new.time_out
+            BEGIN
+                INSERT INTO change_counter (scope, version) VALUES ('attendance:' || old.date, 1)
+                ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+                INSERT INTO change_counter (scope, version)
+                SELECT 'attendance:' || new.date, 1 WHERE new.date IS NOT old.date
+                ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+            END
+        """),
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS change_attendance_ad AFTER DELETE ON attendance BEGIN
+                INSERT INTO change_counter (scope, version) VALUES ('attendance:' || old.date, 1)
+                ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+            END
+        """),
+    ]),
+    (6, "attendance change sequence for the incremental changes feed", [
+        add_column('attendance', 'change_seq', 'INTEGER'),
+        backfill('attendance', 'change_seq = rowid', 'change_seq IS NULL'),
+        # The sequence continues from the highest backfilled value
+        sql("""
+            INSERT INTO change_counter (scope, version)
+            SELECT 'attendance_seq', COALESCE(MAX(change_seq), 0) FROM attendance WHERE true
+            ON CONFLICT(scope) DO UPDATE SET version = MAX(version, excluded.version)
+        """, 'attendance'),
+        sql("CREATE INDEX IF NOT EXISTS idx_attendance_date_seq ON attendance(date, change_seq)", 'attendance'),
+        # Stamp every changed row with the next sequence number. The nested
+        # UPDATE only touches change_seq, which the WHEN clauses ignore.
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS attendance_seq_ai AFTER INSERT ON attendance BEGIN
+                UPDATE change_counter SET version = version + 1 WHERE scope = 'attendance_seq';
+                UPDATE attendance
+                SET change_seq = (SELECT version FROM change_counter WHERE scope = 'attendance_seq')
+                WHERE rowid = new.rowid;
+            END
+        """),
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS attendance_seq_au AFTER UPDATE ON attendance
+            WHEN old.date IS NOT new.date OR old.student_idno IS NOT new.student_idno
+                OR old.status IS NOT new.status OR old.time_in IS NOT new.time_in
+                OR old.time_out IS NOT new.time_out
+            BEGIN
+                UPDATE change_counter SET version = version + 1 WHERE scope = 'attendance_seq';
+                UPDATE attendance
+                SET change_seq = (SELECT version FROM change_counter WHERE scope = 'attendance_seq')
+                WHERE rowid = new.rowid;
+            END
+        """),
+    ]),
+    (7, "resized photo variants with their dimensions", [
+        sql("""
+            CREATE TABLE IF NOT EXISTS photo_variant (
+                image TEXT NOT NULL,
+                size TEXT NOT NULL,
+                path TEXT NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                bytes INTEGER NOT NULL,
+                PRIMARY KEY (image, size)
+            )
+        """),
+        # Student responses embed variant URLs, so new variants change their ETag
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS change_photo_variant_ai AFTER INSERT ON photo_variant BEGIN
+                INSERT INTO change_counter (scope, version) VALUES ('student_account', 1)
+                ON CONFLICT(scope) DO UPDATE SET version = version + 1;
+            END
+        """),
+    ]),
+    (8, "index student photos for content-addressed storage refcounts", [
+        sql("CREATE INDEX IF NOT EXISTS idx_student_image ON student_account(image)", 'student_account'),
+    ]),
+    (9, "student change sequence and tombstones for roster delta sync", [
+        # Reindex only when an indexed column changes: the change_seq backfill
+        # and the sequence triggers below (which run on insert before the row
+        # is in the index) must not touch the full-text index
+        sql("DROP TRIGGER IF EXISTS student_fts_au"),
+        sql("""
+            CREATE TRIGGER student_fts_au AFTER UPDATE OF idno, Lastname, Firstname, course, level
+            ON student_account BEGIN
+                INSERT INTO student_fts (student_fts, rowid, idno, Lastname, Firstname, course, level)
+                VALUES ('delete', old.id, old.idno, old.Lastname, old.Firstname, old.course, old.level);
+                INSERT INTO student_fts (rowid, idno, Lastname, Firstname, course, level)
+                VALUES (new.id, new.idno, new.Lastname, new.Firstname, new.course, new.level);
+                INSERT INTO student_fts_trigram (student_fts_trigram, rowid, idno, Lastname, Firstname, course, level)
+                VALUES ('delete', old.id, old.idno, old.Lastname, old.Firstname, old.course, old.level);
+                INSERT INTO student_fts_trigram (rowid, idno, Lastname, Firstname, course, level)
+                VALUES (new.id, new.idno, new.Lastname, new.Firstname, new.course, new.level);
+            END
+        """),
+        add_column('student_account', 'change_seq', 'INTEGER'),
+        backfill('student_account', 'change_seq = rowid', 'change_seq IS NULL'),
+        sql("""
+            INSERT INTO change_counter (scope, version)
+            SELECT 'student_seq', COALESCE(MAX(change_seq), 0) FROM student_account WHERE true
+            ON CONFLICT(scope) DO UPDATE SET version = MAX(version, excluded.version)
+        """, 'student_account'),
+        sql("CREATE INDEX IF NOT EXISTS idx_student_change_seq ON student_account(change_seq)", 'student_account'),
+        sql("""
+            CREATE TABLE IF NOT EXISTS student_tombstone (
+                idno TEXT PRIMARY KEY,
+                change_seq INTEGER NOT NULL
+            )
+        """),
+        sql("CREATE INDEX IF NOT EXISTS idx_student_tombstone_seq ON student_tombstone(change_seq)", 'student_tombstone'),
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS student_seq_ai AFTER INSERT ON student_account BEGIN
+                UPDATE change_counter SET version = version + 1 WHERE scope = 'student_seq';
+                UPDATE student_account
+                SET change_seq = (SELECT version FROM change_counter WHERE scope = 'student_seq')
+                WHERE rowid = new.rowid;
+                DELETE FROM student_tombstone WHERE idno = new.idno;
+            END
+        """),
+        # The nested UPDATE only touches change_seq, which the WHEN clause ignores
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS student_seq_au AFTER UPDATE ON student_account
+            WHEN old.idno IS NOT new.idno OR old.Lastname IS NOT new.Lastname
+                OR old.Firstname IS NOT new.Firstname OR old.course IS NOT new.course
+                OR old.level IS NOT new.level OR old.image IS NOT new.image
+            BEGIN
+                UPDATE change_counter SET version = version + 1 WHERE scope = 'student_seq';
+                UPDATE student_account
+                SET change_seq = (SELECT version FROM change_counter WHERE scope = 'student_seq')
+                WHERE rowid = new.rowid;
+                INSERT INTO student_tombstone (idno, change_seq)
+                SELECT old.idno, version FROM change_counter
+                WHERE scope = 'student_seq' AND old.idno IS NOT new.idno
+                ON CONFLICT(idno) DO UPDATE SET change_seq = excluded.change_seq;
+            END
+        """),
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS student_seq_ad AFTER DELETE ON student_account BEGIN
+                UPDATE change_counter SET version = version + 1 WHERE scope = 'student_seq';
+                INSERT INTO student_tombstone (idno, change_seq)
+                SELECT old.idno, version FROM change_counter WHERE scope = 'student_seq'
+                ON CONFLICT(idno) DO UPDATE SET change_seq = excluded.change_seq;
+            END
+        """),
+        # A new thumbnail changes the roster entry of every student using the photo
+        sql("""
+            CREATE TRIGGER IF NOT EXISTS student_seq_photo_ai AFTER INSERT ON photo_variant
+            WHEN new.size = 'thumb'
+            BEGIN
+                UPDATE change_counter SET version = version + 1 WHERE scope = 'student_seq';
+                UPDATE student_account
+                SET change_seq = (SELECT version FROM change_counter WHERE scope = 'student_seq')
+                WHERE image = new.image;
+            END
+        """),
+    ]),
+]
+
+
+def _ensure_version_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    """)
+
+
+def _table_exists(conn, table):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+
+def _count_rows(conn, table, where=None):
+    if not table:
+        return 0
+    query = f"SELECT COUNT(*) FROM {table}"
+    if where:
+        query += f" WHERE {where}"
+    return conn.execute(query).fetchone()[0]
+
+
+def _has_column(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+def _estimate(conn, step):
+    """Rows a step will touch: index builds read the table, ALTER only edits the schema
+
+    A table an earlier, not yet applied step would create counts as empty.
+    """
+    kind = step['kind']
+    if not step['table'] or not _table_exists(conn, step['table']):
+        return 0
+    if kind == 'backfill':
+        try:
+            return _count_rows(conn, step['table'], step['where'])
+        except OperationalError:
+            # Column added earlier in the same run: every row is a candidate
+            return _count_rows(conn, step['table'])
+    if kind == 'add_column':
+        return 0
+    return _count_rows(conn, step['table'])
+
+
+def _describe(step):
+    if step['kind'] == 'sql':
+        return ' '.join(step['sql'].split())
+    if step['kind'] == 'add_column':
+        return f"ALTER TABLE {step['table']} ADD COLUMN {step['column']} {step['decl']}"
+    return f"UPDATE {step['table']} SET {step['assignments']} WHERE {step['where']} (batches of {step['batch_size']})"
+
+
+def _acquire_lock(conn, owner):
+    """Take the migration_lock row, waiting up to LOCK_TIMEOUT for another run"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS migration_lock (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            owner TEXT NOT NULL,
+            heartbeat REAL NOT NULL
+        )
+    """)
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        holder = None
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            holder = conn.execute("SELECT owner, heartbeat FROM migration_lock").fetchone()
+            if holder is None or holder[1] < time.time() - LOCK_STALE:
+                conn.execute(
+                    "INSERT OR REPLACE INTO migration_lock (id, owner, heartbeat) VALUES (1, ?, ?)",
+                    (owner, time.time()))
+                conn.commit()
+                return
+            conn.rollback()
+        except OperationalError as e:
+            # A long write elsewhere outlasted busy_timeout: keep waiting
+            if 'locked' not in str(e):
+                raise
+            if conn.in_transaction:
+                conn.rollback()
+        if time.monotonic() > deadline:
+            raise OperationalError(
+                f"Timed out waiting for migrations run by {holder[0] if holder else 'another process'}")
+        time.sleep(0.5)
+
+
+def _refresh_lock(conn, owner):
+    """Mark the lock as alive; runs inside each step's transaction"""
+    conn.execute("UPDATE migration_lock SET heartbeat = ? WHERE id = 1 AND owner = ?",
+                 (time.time(), owner))
+
+
+def _release_lock(conn, owner):
+    if conn.in_transaction:
+        conn.rollback()
+    conn.execute("DELETE FROM migration_lock WHERE id = 1 AND owner = ?", (owner,))
+    conn.commit()
+
+
+def _run_step(conn, step, owner):
+    kind = step['kind']
+    if kind == 'sql':
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(step['sql'])
+        _refresh_lock(conn, owner)
+        conn.commit()
+        return 0
+    if kind == 'add_column':
+        if not _has_column(conn, step['table'], step['column']):
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                f"ALTER TABLE {step['table']} ADD COLUMN {step['column']} {step['decl']}")
+            _refresh_lock(conn, owner)
+            conn.commit()
+        return 0
+
+    touched = 0
+    table = step['table']
+    while True:
+        cursor = conn.execute(f"""
+            UPDATE {table} SET {step['assignments']}
+            WHERE rowid IN (SELECT rowid FROM {table} WHERE {step['where']} LIMIT ?)
+        """, (step['batch_size'],))
+        _refresh_lock(conn, owner)
+        conn.commit()
+        touched += cursor.rowcount
+        if cursor.rowcount < step['batch_size']:
+            return touched
+
+
+def get_version(conn):
+    """Get the highest applied migration version (0 for none), without writing"""
+    if not _table_exists(conn, 'schema_version'):
+        return 0
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def is_current(conn):
+    """True when every migration is applied"""
+    return get_version(conn) >= MIGRATIONS[-1][0]
+
+
+def migrate(conn, dry_run=False, target=None):
+    """Apply pending migrations in order, returns a report per migration
+
+    With dry_run nothing is changed and each step reports the rows it is
+    estimated to touch. Otherwise the run holds the migration lock, and
+    migrations another process applied while this one waited are skipped.
+    """
+    owner = None
+    if not dry_run:
+        owner = f"pid {os.getpid()} ({uuid.uuid4().hex[:8]})"
+        _acquire_lock(conn, owner)
+    try:
+        if not dry_run:
+            _ensure_version_table(conn)
+            conn.commit()
+        # Read under the lock: a run we waited for may have applied some
+        current = get_version(conn)
+        report = []
+
+        for version, description, steps in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if version <= current or (target is not None and version > target):
+                continue
+
+            entry = {'version': version, 'description': description, 'steps': []}
+            report.append(entry)
+
+            for step in steps:
+                item = {'step': _describe(step), 'estimated_rows': _estimate(conn, step)}
+                if not dry_run:
+                    touched = _run_step(conn, step, owner)
+                    if step['kind'] == 'backfill':
+                        item['rows'] = touched
+                entry['steps'].append(item)
+
+            if not dry_run:
+                conn.execute(
+                    "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                    (version, description, datetime.now().isoformat(timespec='seconds'))
+                )
+                conn.commit()
+                print(f"Applied migration {version}: {description}")
+
+        return report
+    finally:
+        if owner:
+            _release_lock(conn, owner)
@@ -0,0 +1,149 @@
+import atexit
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Key derivation cost: scrypt uses 128 * N * R bytes and time roughly
+# proportional to N * R * P. Check changes with `flask --app app bench-passwords`;
+# stored hashes with other parameters are upgraded on the next login.
+SCRYPT_N: int = 2 ** 14
+SCRYPT_R: int = 8
+SCRYPT_P: int = 1
+SALT_BYTES: int = 16
+KEY_BYTES: int = 32
+
+# Hashing pool settings: hashlib releases the GIL while deriving, so
+# WORKERS bounds the cores logins can take from other requests
+WORKERS: int = 2
+MAX_PENDING: int = 16       # waiting logins before new ones are refused
+
+SCHEME = 'scrypt'
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='password-hasher')
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+_lock = threading.Lock()
+_stats = {
+    'hashed': 0,
+    'verified': 0,
+    'failed': 0,
+    'upgraded': 0,
+    'rejected': 0,
+    'total_ms': 0.0,
+}
+
+
+class Busy(Exception):
+    """Raised when MAX_PENDING password checks are already waiting"""
+
+
+def _derive(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * r * (n + p + 2) + 1024 * 1024, dklen=KEY_BYTES)
+
+
+def _hash(password):
+    salt = os.urandom(SALT_BYTES)
+    key = _derive(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"{SCHEME}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${key.hex()}"
+
+
+def _parse(stored):
+    """Split a stored hash into (n, r, p, salt, key), None for a plaintext value"""
+    parts = stored.split('$')
+    if len(parts) != 6 or parts[0] != SCHEME:
+        return None
+    try:
+        n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+        return n, r, p, bytes.fromhex(parts[4]), bytes.fromhex(parts[5])
+    except ValueError:
+        return None
+
+
+def is_hashed(stored):
+    return bool(stored) and _parse(stored) is not None
+
+
+def _verify(password, stored):
+    if not stored:
+        # Unknown user: spend the same time so logins do not reveal emails
+        _derive(password, b'\0' * SALT_BYTES, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+        return False, None
+
+    parsed = _parse(stored)
+    if parsed is None:
+        # Plaintext from before hashing was introduced
+        ok = hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+        return ok, _hash(password) if ok else None
+
+    n, r, p, salt, key = parsed
+    if not hmac.compare_digest(_derive(password, salt, n, r, p), key):
+        return False, None
+    if (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P) or len(salt) != SALT_BYTES:
+        return True, _hash(password)
+    return True, None
+
+
+def _submit(fn, *args):
+    """Run fn on the hashing pool and wait for it; Busy when the pool is full"""
+    if not _slots.acquire(blocking=False):
+        with _lock:
+            _stats['rejected'] += 1
+        raise Busy("Too many logins in progress, please try again")
+    started = time.perf_counter()
+    try:
+        return _executor.submit(fn, *args).result()
+    finally:
+        _slots.release()
+        with _lock:
+            _stats['total_ms'] += (time.perf_counter() - started) * 1000
+
+
+def hash_password(password):
+    """Get a salted scrypt hash of a password for storage"""
+    stored = _submit(_hash, password)
+    with _lock:
+        _stats['hashed'] += 1
+    return stored
+
+
+def verify(password, stored):
+    """Check a password against its stored value, returns (ok, new_hash)
+
+    new_hash is set when the stored value is plaintext or was hashed with
+    other cost parameters and should be replaced. stored may be None for
+    an unknown user, which costs as much as a wrong password.
+    """
+    ok, new_hash = _submit(_verify, password, stored)
+    with _lock:
+        _stats['verified' if ok else 'failed'] += 1
+        if new_hash:
+            _stats['upgraded'] += 1
+    return ok, new_hash
+
+
+def benchmark(n, r=SCRYPT_R, p=SCRYPT_P, rounds=5):
+    """Average milliseconds of one key derivation with the given cost"""
+    salt = os.urandom(SALT_BYTES)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        _derive('benchmark', salt, n, r, p)
+    return (time.perf_counter() - started) * 1000 / rounds
+
+
+def get_stats():
+    """Get hashing pool counters"""
+    with _lock:
+        stats = dict(_stats)
+    total = stats.pop('total_ms')
+    checks = stats['hashed'] + stats['verified'] + stats['failed']
+    stats['avg_ms'] = total / checks if checks else 0.0
+    stats['workers'] = WORKERS
+    stats['max_pending'] = MAX_PENDING
+    stats['cost'] = {'n': SCRYPT_N, 'r': SCRYPT_R, 'p': SCRYPT_P}
+    return stats
+
+
+atexit.register(_executor.shutdown)
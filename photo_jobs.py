@@ -0,0 +1,352 @@
+import atexit
+import base64
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import db_helper
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow is optional: without it photos are served full size
+    Image = None
+
+# Photo writer settings
+WORKERS: int = 2            # threads decoding and writing photos
+MAX_PENDING: int = 8        # queued photos (each holds its data URL in memory)
+MAX_TRACKED: int = 1000     # recent jobs kept for status checks
+
+STATIC_FOLDER = 'static'
+IMAGE_FOLDER = 'images'
+PHOTO_EXTENSIONS = {'jpg', 'png', 'gif', 'webp'}
+
+# Resized copies made of every photo: longest side in pixels
+VARIANT_SIZES = {'thumb': 96, 'medium': 320}
+VARIANT_QUALITY: int = 80
+
+# Photos stored (or matched by an identical upload) this recently are left
+# for collect_garbage(): the upload may be about to refer to them
+RECENT_SECONDS: int = 300
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='photo-writer')
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+_lock = threading.Lock()
+_jobs = OrderedDict()
+_stats = {
+    'submitted': 0,
+    'inline': 0,
+    'saved': 0,
+    'failed': 0,
+    'variants': 0,
+    'total_ms': 0.0,
+}
+
+
+def image_format(image_data):
+    """Get the file extension of a base64 data URL"""
+    if ';base64,' in image_data:
+        format_part = image_data.split(';')[0].split('/')[-1]
+    else:
+        format_part = 'jpeg'
+    return 'jpg' if format_part == 'jpeg' else format_part
+
+
+def static_image(image):
+    """Normalize a stored image value to a path under static/"""
+    return image if image.startswith('images/') else f"images/{image}"
+
+
+def content_path(digest, ext):
+    """images/<first two hex digits>/<sha256>.<ext>: 256 shards keep directories small"""
+    return f"{IMAGE_FOLDER}/{digest[:2]}/{digest}.{ext}"
+
+
+def store_stream(src, ext):
+    """Copy a binary stream into content-addressed storage, returns (image path, bytes)
+
+    The data is hashed while it is written to a temporary file, which is
+    then renamed to its content path. Identical photos share one file.
+    """
+    if ext not in PHOTO_EXTENSIONS:
+        raise ValueError(f"Unsupported image type: {ext}")
+    folder = os.path.join(STATIC_FOLDER, IMAGE_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(suffix='.part', dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for block in iter(lambda: src.read(1024 * 1024), b''):
+                digest.update(block)
+                f.write(block)
+                size += len(block)
+        if not size:
+            raise ValueError("Empty image")
+
+        image_path = content_path(digest.hexdigest(), ext)
+        filepath = os.path.join(STATIC_FOLDER, image_path)
+        if os.path.exists(filepath):
+            os.remove(temp_path)
+            # Same bytes as a stored photo: mark it recent so remove_photo()
+            # and collect_garbage() leave it alone until it is referenced
+            os.utime(filepath)
+        else:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            os.replace(temp_path, filepath)
+        return image_path, size
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def store_photo(image_data):
+    """Decode a base64 data URL into content-addressed storage, returns (image path, bytes)"""
+    ext = image_format(image_data)
+    if 'base64,' in image_data:
+        image_data = image_data.split('base64,')[1]
+    image_binary = base64.b64decode(image_data, validate=True)
+    return store_stream(io.BytesIO(image_binary), ext)
+
+
+def make_variants(image_path, force=False):
+    """Write the VARIANT_SIZES copies of a stored photo and record their dimensions
+
+    Variants sit next to their original as <name>_<size>.webp (JPEG when
+    Pillow has no WebP support). A photo that already has variants is
+    left alone unless force is set; then they are rebuilt, and old files
+    the new set no longer uses are deleted. Returns {size: (path, width,
+    height, bytes)}, empty when Pillow is not installed.
+    """
+    if Image is None:
+        return {}
+    existing = db_helper.get_photo_variants(image_path)
+    if existing and not force:
+        return {size: tuple(row)[1:] for size, row in existing.items()}
+
+    fmt, ext = ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+    stem = os.path.splitext(image_path)[0]
+
+    variants = {}
+    with Image.open(os.path.join(STATIC_FOLDER, image_path)) as original:
+        photo = ImageOps.exif_transpose(original).convert('RGB')
+        for size, pixels in VARIANT_SIZES.items():
+            variant = photo.copy()
+            variant.thumbnail((pixels, pixels))
+            path = f"{stem}_{size}.{ext}"
+            filepath = os.path.join(STATIC_FOLDER, path)
+            # Two uploads of the same photo may resize it at the same time
+            temp_path = f"{filepath}.{threading.get_ident()}.part"
+            variant.save(temp_path, fmt, quality=VARIANT_QUALITY)
+            os.replace(temp_path, filepath)
+            variants[size] = (path, variant.width, variant.height, os.path.getsize(filepath))
+
+    db_helper.save_photo_variants(image_path, variants)
+    # Sizes dropped from VARIANT_SIZES, or written in another format
+    current = {path for path, _, _, _ in variants.values()}
+    for row in existing.values():
+        if row['path'] not in current:
+            _delete_file(row['path'])
+    return variants
+
+
+def _delete_file(path):
+    filepath = os.path.join(STATIC_FOLDER, path)
+    if os.path.exists(filepath):
+        try:
+            os.remove(filepath)
+            print(f"Deleted image: {filepath}")
+            return True
+        except Exception as e:
+            print(f"Error deleting image: {e}")
+    return False
+
+
+def _in_use(image_path):
+    """True if a student refers to the photo, by path or legacy bare file name"""
+    name = image_path[len(IMAGE_FOLDER) + 1:]
+    if db_helper.count_image_refs(image_path):
+        return True
+    return '/' not in name and db_helper.count_image_refs(name) > 0
+
+
+def _is_recent(path):
+    try:
+        return time.time() - os.stat(os.path.join(STATIC_FOLDER, path)).st_mtime < RECENT_SECONDS
+    except OSError:
+        return False
+
+
+def remove_photo(image):
+    """Delete a photo and its variants once no student refers to it
+
+    Returns False (and keeps the files) while the photo is still in use,
+    or if it was stored within RECENT_SECONDS; collect_garbage() removes
+    such a photo later if nothing came to refer to it.
+    """
+    image_path = static_image(image)
+    if _in_use(image_path) or _is_recent(image_path):
+        return False
+    variants = [row['path'] for row in db_helper.get_photo_variants(image_path).values()]
+    # Checked again right before unlinking: an upload may have just claimed it
+    if _in_use(image_path):
+        return False
+    for path in [image_path] + variants:
+        _delete_file(path)
+    db_helper.delete_photo_variants(image_path)
+    return True
+
+
+def collect_garbage(min_age=3600, dry_run=False):
+    """Remove photo files no student refers to
+
+    Walks static/images, keeps every referenced photo and its variants,
+    and deletes the rest if older than min_age seconds (so uploads still
+    being processed are never touched). Returns a report.
+    """
+    referenced = {static_image(image) for image in db_helper.get_referenced_images()}
+    keep = set(referenced)
+    for image in db_helper.get_variant_images():
+        if image in referenced:
+            keep.update(row['path'] for row in db_helper.get_photo_variants(image).values())
+        elif not dry_run:
+            db_helper.delete_photo_variants(image)
+
+    report = {'files': 0, 'kept': 0, 'removed': 0, 'bytes': 0, 'too_new': 0}
+    cutoff = time.time() - min_age
+    root = os.path.join(STATIC_FOLDER, IMAGE_FOLDER)
+    for folder, _, files in os.walk(root):
+        for name in files:
+            if name.startswith('.'):
+                continue
+            report['files'] += 1
+            filepath = os.path.join(folder, name)
+            path = os.path.relpath(filepath, STATIC_FOLDER).replace(os.sep, '/')
+            if path in keep:
+                report['kept'] += 1
+                continue
+            stat = os.stat(filepath)
+            if stat.st_mtime > cutoff:
+                report['too_new'] += 1
+                continue
+            if not dry_run:
+                # The walk takes a while: a student or an identical upload
+                # may have claimed the file since the referenced set was read
+                if _in_use(path) or os.stat(filepath).st_mtime > cutoff:
+                    report['kept'] += 1
+                    continue
+                os.remove(filepath)
+            report['removed'] += 1
+            report['bytes'] += stat.st_size
+    return report
+
+
+def _track(student_id, **job):
+    with _lock:
+        entry = _jobs.setdefault(student_id, {})
+        entry.update(job)
+        _jobs.move_to_end(student_id)
+        while len(_jobs) > MAX_TRACKED:
+            _jobs.popitem(last=False)
+
+
+def _save(student_id, image_data, old_image):
+    started = time.perf_counter()
+    try:
+        image_path, size = store_photo(image_data)
+    except Exception as e:
+        print(f"Error saving image: {e}")
+        with _lock:
+            _stats['failed'] += 1
+        _track(student_id, status='failed', message=str(e))
+        return
+
+    print(f"Image saved successfully: {image_path}, size: {size} bytes")
+    # The record keeps its previous photo until the new one is on disk;
+    # if it changed meanwhile (another upload won) this photo is dropped
+    if not db_helper.set_student_image(student_id, image_path, old_image):
+        remove_photo(image_path)
+        with _lock:
+            _stats['failed'] += 1
+        _track(student_id, status='failed', message='Student photo changed meanwhile')
+        return
+
+    try:
+        variants = make_variants(image_path)
+    except Exception as e:
+        # The original is still served when resizing fails
+        print(f"Error resizing image: {e}")
+        variants = {}
+    if old_image and old_image != image_path:
+        remove_photo(old_image)
+    with _lock:
+        _stats['saved'] += 1
+        _stats['variants'] += len(variants)
+        _stats['total_ms'] += (time.perf_counter() - started) * 1000
+    _track(student_id, status='saved', image=image_path)
+
+
+def _run(student_id, image_data, old_image):
+    try:
+        _save(student_id, image_data, old_image)
+    finally:
+        db_helper.release_connection()
+        _slots.release()
+
+
+def submit(student_id, image_data, old_image=None):
+    """Store a student's photo in the background after its record was saved
+
+    The record keeps old_image until the new photo is written, then points
+    at its content path. When MAX_PENDING photos are already waiting the
+    photo is written in the calling thread instead, so memory held by
+    queued uploads stays bounded.
+    """
+    _track(student_id, status='pending', image=old_image, message=None)
+    if not _slots.acquire(blocking=False):
+        with _lock:
+            _stats['inline'] += 1
+        _save(student_id, image_data, old_image)
+        return
+    with _lock:
+        _stats['submitted'] += 1
+    try:
+        _executor.submit(_run, student_id, image_data, old_image)
+    except RuntimeError:
+        # Interpreter shutting down
+        _slots.release()
+        _save(student_id, image_data, old_image)
+
+
+def get_status(student_id):
+    """Get the latest photo job of a student (None if not tracked)"""
+    with _lock:
+        job = _jobs.get(student_id)
+        return dict(job) if job else None
+
+
+def get_stats():
+    """Get photo writer counters"""
+    with _lock:
+        stats = dict(_stats)
+        stats['pending'] = sum(1 for job in _jobs.values() if job.get('status') == 'pending')
+    total = stats.pop('total_ms')
+    stats['avg_ms'] = total / stats['saved'] if stats['saved'] else 0.0
+    stats['workers'] = WORKERS
+    stats['max_pending'] = MAX_PENDING
+    stats['resizing'] = Image is not None
+    return stats
+
+
+def stop():
+    """Finish queued photos before exit"""
+    _executor.shutdown(wait=True)
+
+
+atexit.register(stop)
@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Rate limit for the public scanner endpoints, per client address:
+# RATE requests per second on average, bursts of up to BURST
+RATE: float = 10.0
+BURST: int = 30
+MAX_CLIENTS: int = 10000        # buckets kept, least recently seen dropped first
+
+# A scan of the same student on the same date within DEDUPE_SECONDS is
+# answered from memory instead of being written again
+DEDUPE_SECONDS: float = 30.0
+MAX_SCANS: int = 10000
+
+_lock = threading.Lock()
+_buckets = OrderedDict()        # client -> [tokens, last refill]
+_scans = OrderedDict()          # (student_idno, date) -> (expires, attendance)
+_stats = {
+    'allowed': 0,
+    'limited': 0,
+    'deduped': 0,
+}
+
+
+def allow(client):
+    """Take a token from the client's bucket, returns seconds to wait (0 when allowed)"""
+    now = time.monotonic()
+    with _lock:
+        bucket = _buckets.get(client)
+        if bucket is None:
+            bucket = _buckets[client] = [float(BURST), now]
+            while len(_buckets) > MAX_CLIENTS:
+                _buckets.popitem(last=False)
+        else:
+            _buckets.move_to_end(client)
+            bucket[0] = min(BURST, bucket[0] + (now - bucket[1]) * RATE)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            _stats['allowed'] += 1
+            return 0
+        _stats['limited'] += 1
+        return (1 - bucket[0]) / RATE
+
+
+def recent_scan(student_idno, date, status):
+    """Get the attendance remembered for a repeated scan, None if it must be written
+
+    A scan with another status than the remembered one is not a repeat.
+    """
+    key = (student_idno, date)
+    now = time.monotonic()
+    with _lock:
+        entry = _scans.get(key)
+        if entry is None:
+            return None
+        expires, attendance = entry
+        if expires < now:
+            del _scans[key]
+            return None
+        if attendance['status'] != status:
+            return None
+        _stats['deduped'] += 1
+        return dict(attendance)
+
+
+def remember_scan(student_idno, date, attendance):
+    """Remember a written scan for DEDUPE_SECONDS"""
+    key = (student_idno, date)
+    with _lock:
+        _scans[key] = (time.monotonic() + DEDUPE_SECONDS, dict(attendance))
+        _scans.move_to_end(key)
+        while len(_scans) > MAX_SCANS:
+            _scans.popitem(last=False)
+
+
+def forget_scan(student_idno, date):
+    """Drop a remembered scan after its attendance was changed elsewhere"""
+    with _lock:
+        _scans.pop((student_idno, date), None)
+
+
+def get_stats():
+    """Get rate limit and duplicate scan counters"""
+    with _lock:
+        stats = dict(_stats)
+        stats['clients'] = len(_buckets)
+        stats['remembered_scans'] = len(_scans)
+    stats['rate'] = RATE
+    stats['burst'] = BURST
+    stats['dedupe_seconds'] = DEDUPE_SECONDS
+    return stats
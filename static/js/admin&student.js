@@ -167,6 +167,12 @@ function normalizeImagePath(imagePath) {
     return `/static/images/${imagePath}`;
 }
 
+// Resized variant from the API (thumb or medium) when there is one, else the original
+function studentPhotoUrl(student, size) {
+    const variant = student.photo && student.photo[size];
+    return variant ? variant.url : normalizeImagePath(student.image);
+}
+
 function showFormActionButtons() {
     const buttonContainer = document.getElementById('formActionButtons');
     if (buttonContainer) buttonContainer.classList.remove('hidden');
@@ -229,7 +235,7 @@ function viewStudentInForm(studentId) {
             const imageDisplay = document.getElementById('imageDisplay');
             const imagePlaceholder = document.getElementById('imagePlaceholder');
 
-            const imagePath = normalizeImagePath(student.image);
+            const imagePath = studentPhotoUrl(student, 'medium');
             if (imagePath && imageDisplay && imagePlaceholder) {
                 imageDisplay.src = imagePath;
                 imageDisplay.classList.remove('hidden');
@@ -259,7 +265,7 @@ function viewStudent(studentId) {
             if (!data || !data.success) return alert('Error: Student not found');
 
             const student = data.student;
-            const imagePath = normalizeImagePath(student.image);
+            const imagePath = studentPhotoUrl(student, 'medium');
 
             const modalContent = `
                 <div class="space-y-4">
@@ -390,7 +396,7 @@ function editStudent(studentId) {
 
             // Handle profile image
             if (student.image) {
-                const imagePath = normalizeImagePath(student.image);
+                const imagePath = studentPhotoUrl(student, 'medium');
                 const profileIcon = document.getElementById('profileIcon');
                 const profilePlaceholder = document.getElementById('profilePlaceholder');
                 if (profileIcon && profilePlaceholder) {
@@ -7,6 +7,15 @@
 let currentSelectedStudent = null;
 let currentDate = new Date().toISOString().split('T')[0];
 
+// Change feed position and the table rows by student ID, so later updates
+// only touch the rows that changed
+let attendanceCursor = null;
+let attendanceRows = new Map();
+
+// When the server refuses the event stream: poll this often, retry the stream after
+const STREAM_POLL_MS = 15000;
+const STREAM_RETRY_MS = 60000;
+
 // ============================================
 // TIME FORMATTING HELPER
 // ============================================
@@ -77,6 +86,46 @@ function initializeAttendance() {
     if (exportBtn) {
         exportBtn.addEventListener('click', exportAttendance);
     }
+
+    connectAttendanceStream();
+}
+
+/**
+ * Listen for attendance changes pushed by the server (scans at the gate,
+ * status changes from other dashboards). Events only name the date; the
+ * changed rows come from the changes feed. EventSource reconnects itself.
+ */
+function connectAttendanceStream() {
+    if (!window.EventSource || !document.getElementById('attendanceTableBody')) return;
+
+    let pending = null;
+    const refresh = () => {
+        // Coalesce bursts of events into one changes request
+        clearTimeout(pending);
+        pending = setTimeout(() => loadAttendanceChanges(currentDate), 200);
+    };
+
+    const source = new EventSource('/api/attendance/stream');
+    source.addEventListener('attendance', (e) => {
+        const event = JSON.parse(e.data);
+        if (event.date === currentDate) refresh();
+    });
+    // Events were dropped: the cursor still knows what was missed
+    source.addEventListener('resync', refresh);
+    // Scans made while disconnected (the first load fetches the day itself)
+    source.addEventListener('open', () => {
+        if (attendanceCursor !== null) refresh();
+    });
+    // Refused (too many open streams, 503): the browser gives up, so poll
+    // the changes feed for a while and then try the stream again
+    source.addEventListener('error', () => {
+        if (source.readyState !== EventSource.CLOSED) return;
+        const poll = setInterval(refresh, STREAM_POLL_MS);
+        setTimeout(() => {
+            clearInterval(poll);
+            connectAttendanceStream();
+        }, STREAM_RETRY_MS);
+    });
 }
 
 
@@ -97,6 +146,7 @@ async function loadAttendance(date) {
 
         if (data.success) {
             console.log('✅ Attendance data loaded:', data.attendance.length, 'records');
+            attendanceCursor = data.cursor;
             displayAttendance(data.attendance);
             updateStats(data.stats);
         } else {
@@ -109,6 +159,39 @@ async function loadAttendance(date) {
 }
 
 
+/**
+ * Apply the rows changed since the last load instead of reloading the day
+ * @param {string} date - Date in YYYY-MM-DD format
+ */
+async function loadAttendanceChanges(date) {
+    if (attendanceCursor === null) {
+        return loadAttendance(date);
+    }
+
+    try {
+        let more = true;
+        while (more) {
+            const response = await fetch(`/api/attendance/${date}/changes?since=${attendanceCursor}`);
+            const data = await response.json();
+
+            if (!data.success) {
+                showError('Failed to load attendance: ' + data.message);
+                return;
+            }
+            if (date !== currentDate) return; // Another date was opened meanwhile
+
+            data.changes.forEach(applyAttendanceChange);
+            if (data.stats) updateStats(data.stats);
+            attendanceCursor = data.cursor;
+            more = data.more;
+        }
+    } catch (error) {
+        console.error('❌ Error loading attendance changes:', error);
+        showError('Error loading attendance data');
+    }
+}
+
+
 // ============================================
 // ATTENDANCE DISPLAY
 // ============================================
@@ -122,6 +205,7 @@ function displayAttendance(attendanceRecords) {
     if (!tbody) return;
 
     tbody.innerHTML = '';
+    attendanceRows = new Map();
 
     if (attendanceRecords.length === 0) {
         tbody.innerHTML = `
@@ -138,38 +222,68 @@ function displayAttendance(attendanceRecords) {
     }
 
     attendanceRecords.forEach(record => {
-        const row = document.createElement('tr');
-        row.className = 'hover:bg-gray-50 transition';
-
-        const statusClass = getStatusClass(record.status);
-        const statusBadge = `
-            <span class="${statusClass} px-2 sm:px-4 md:px-5 py-1 sm:py-2 md:py-3 rounded-full text-xs sm:text-base md:text-lg lg:text-xl font-bold inline-flex items-center gap-1 sm:gap-2 cursor-pointer hover:opacity-80 transition shadow-sm">
-                ${getStatusIcon(record.status)}
-                ${record.status}
-            </span>
-        `;
+        const row = createAttendanceRow(record);
+        attendanceRows.set(record.idno, row);
+        tbody.appendChild(row);
+    });
+}
 
-        // Format times with AM/PM
-        const timeIn = formatTimeWithAMPM(record.time_in);
-
-        row.innerHTML = `
-            <td class="px-3 sm:px-6 md:px-10 py-3 sm:py-5 md:py-6 text-xs sm:text-lg md:text-xl lg:text-2xl text-blue-600 font-bold">${record.idno}</td>
-            <td class="px-3 sm:px-6 md:px-10 py-3 sm:py-5 md:py-6 text-xs sm:text-lg md:text-xl lg:text-2xl text-gray-800 font-semibold">${timeIn}</td>
-            <td class="px-3 sm:px-6 md:px-10 py-3 sm:py-5 md:py-6 text-xs sm:text-lg md:text-xl lg:text-2xl text-gray-800 font-medium">${record.Firstname} ${record.Lastname}</td>
-            <td class="px-3 sm:px-6 md:px-10 py-3 sm:py-5 md:py-6 text-xs sm:text-lg md:text-xl lg:text-2xl text-gray-700 font-medium">${record.course} - ${record.level}</td>
-            <td class="px-3 sm:px-6 md:px-10 py-3 sm:py-5 md:py-6 text-center">
-                ${statusBadge}
-            </td>
-        `;
+/**
+ * Replace (or add) the table row of one changed record
+ * @param {Object} record - Attendance record from the changes feed
+ */
+function applyAttendanceChange(record) {
+    const tbody = document.getElementById('attendanceTableBody');
+    if (!tbody) return;
 
+    const row = createAttendanceRow(record);
+    const existing = attendanceRows.get(record.idno);
+    if (existing) {
+        existing.replaceWith(row);
+    } else {
+        if (attendanceRows.size === 0) tbody.innerHTML = ''; // Drop the empty-state row
         tbody.appendChild(row);
+    }
+    attendanceRows.set(record.idno, row);
+}
 
-        // Add click event listener to the status badge for toggling
-        const statusSpan = row.querySelector('span');
-        statusSpan.addEventListener('click', function () {
-            toggleStatus(record.idno, record.status);
-        });
+/**
+ * Build the table row of one attendance record with AM/PM format
+ * @param {Object} record - Attendance record
+ * @returns {HTMLTableRowElement} - Table row
+ */
+function createAttendanceRow(record) {
+    const row = document.createElement('tr');
+    row.className = 'hover:bg-gray-50 transition';
+
+    const statusClass = getStatusClass(record.status);
+    const statusBadge = `
+        <span class="${statusClass} px-2 sm:px-4 md:px-5 py-1 sm:py-2 md:py-3 rounded-full text-xs sm:text-base md:text-lg lg:text-xl font-bold inline-flex items-center gap-1 sm:gap-2 cursor-pointer hover:opacity-80 transition shadow-sm">
+            ${getStatusIcon(record.status)}
+            ${record.status}
+        </span>
+    `;
+
+    // Format times with AM/PM
+    const timeIn = formatTimeWithAMPM(record.time_in);
+
+    row.innerHTML = `
+        <td class="px-3 sm:px-6 md:px-10 py-3 sm:py-5 md:py-6 text-xs sm:text-lg md:text-xl lg:text-2xl text-blue-600 font-bold">${record.idno}</td>
+        <td class="px-3 sm:px-6 md:px-10 py-3 sm:py-5 md:py-6 text-xs sm:text-lg md:text-xl lg:text-2xl text-gray-800 font-semibold">${timeIn}</td>
+        <td class="px-3 sm:px-6 md:px-10 py-3 sm:py-5 md:py-6 text-xs sm:text-lg md:text-xl lg:text-2xl text-gray-800 font-medium">${record.Firstname} ${record.Lastname}</td>
+        <td class="px-3 sm:px-6 md:px-10 py-3 sm:py-5 md:py-6 text-xs sm:text-lg md:text-xl lg:text-2xl text-gray-700 font-medium">${record.course} - ${record.level}</td>
+        <td class="px-3 sm:px-6 md:px-10 py-3 sm:py-5 md:py-6 text-center">
+            ${statusBadge}
+        </td>
+    `;
+
+    // Add click event listener to the status badge for toggling
+    const statusSpan = row.querySelector('span');
+    statusSpan.addEventListener('click', function () {
+        toggleStatus(record.idno, record.status);
     });
+
+    return row;
 }
 
 
@@ -203,12 +317,12 @@ function updateStats(stats) {
 
 /**
  * Update attendance table (called from QR scanner)
- * Reloads the current date's attendance
+ * Applies the current date's changes since the last load
  */
 function updateAttendanceTable() {
     console.log('🔄 Updating attendance table from scanner...');
-    if (typeof loadAttendance === 'function') {
-        loadAttendance(currentDate);
+    if (typeof loadAttendanceChanges === 'function') {
+        loadAttendanceChanges(currentDate);
     }
 }
 
@@ -299,7 +413,7 @@ async function toggleStatus(studentIdno, currentStatus) {
 
         if (data.success) {
             console.log('✅ Status updated successfully');
-            loadAttendance(currentDate); // Reload attendance
+            loadAttendanceChanges(currentDate); // Apply the changed row
         } else {
             console.error('❌ Failed to update status:', data.message);
             showError('Failed to update status: ' + data.message);
@@ -143,7 +143,7 @@ function fetchStudentInfo(studentId) {
     fetch(`/api/student_public/${studentId}`)
         .then(response => {
             console.log('📥 Response status:', response.status);
-            return response.json();
+            return checkBusy(response);
         })
         .then(data => {
             console.log('📦 Student data received:', data);
@@ -165,11 +165,21 @@ function fetchStudentInfo(studentId) {
 // MODAL DISPLAY
 // ============================================
 
-function showStudentModal(student) {
+function showStudentModal(student, scan) {
     console.log('🎯 Showing student modal:', student);
 
-    // Normalize image path
-    let imagePath = student.image;
+    // Today's attendance from the scan response, if there is one
+    const attendance = scan && scan.attendance;
+    const title = scan && scan.duplicate ? 'Already Logged Today' : 'Attendance Logged';
+    const attendanceInfo = attendance
+        ? `<div class="bg-linear-to-r from-green-50 to-green-100 rounded-xl p-6 shadow-sm">
+               <p class="text-sm text-gray-500 uppercase font-bold mb-2 tracking-wide">Today</p>
+               <p class="text-lg md:text-xl font-bold text-gray-700">${attendance.status} · Time in ${attendance.time_in || '-'}</p>
+           </div>`
+        : '';
+
+    // Prefer the resized variant, else normalize the original image path
+    let imagePath = student.photo && student.photo.medium ? student.photo.medium.url : student.image;
     if (imagePath && !imagePath.startsWith('/static/') && !imagePath.startsWith('http')) {
         if (imagePath.startsWith('images/')) {
             imagePath = `/static/${imagePath}`;
@@ -205,7 +215,7 @@ function showStudentModal(student) {
                         <svg class="w-8 h-8 md:w-10 md:h-10" fill="none" stroke="currentColor" viewBox="0 0 24 24">
                             <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M9 12l2 2 4-4m6 2a9 9 0 11-18 0 9 9 0 0118 0z"/>
                         </svg>
-                        Attendance Logged
+                        ${title}
                     </h3>
                     <button class="close-modal text-white hover:text-gray-200 text-3xl font-bold leading-none transition hover:scale-110">×</button>
                 </div>
@@ -239,6 +249,8 @@ function showStudentModal(student) {
                                 <p class="text-lg md:text-xl font-bold text-gray-700">${getYearLevelText(student.level)}</p>
                             </div>
                         </div>
+
+                        ${attendanceInfo}
                     </div>
 
                     <div class="mt-8 pt-6 border-t-2 border-gray-200">
@@ -406,7 +418,7 @@ function removeModal(modal) {
 // ATTENDANCE MARKING - FIXED
 // ============================================
 
-function markAttendance(studentId) {
+async function markAttendance(studentId) {
     const currentDate = new Date().toISOString().split('T')[0];
     const currentTime = new Date().toLocaleTimeString('en-US', {
         hour12: false,
@@ -420,8 +432,23 @@ function markAttendance(studentId) {
         time: currentTime
     });
 
-    // FIXED: Use the correct endpoint that works without authentication
-    fetch('/api/attendance/mark', {
+    // Students in the cached roster are shown at once; only the write
+    // goes to the server (and is buffered when the network is down)
+    const localStudent = await getRosterStudent(studentId);
+    if (localStudent) {
+        showStudentModal(localStudent);
+        sendScan({
+            student_idno: studentId,
+            date: currentDate,
+            time_in: currentTime,
+            status: 'PRESENT'
+        });
+        return;
+    }
+
+    // Not in the roster (or no roster yet): ask the server, which also
+    // knows students added since the last sync
+    fetch('/api/attendance/scan', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
@@ -433,30 +460,292 @@ function markAttendance(studentId) {
             status: 'PRESENT'
         })
     })
-        .then(response => response.json())
+        .then(checkBusy)
         .then(data => {
-            if (data.success) {
-                console.log('✅ Attendance marked successfully');
-                // Fetch and display student info after successful attendance marking
-                fetchStudentInfo(studentId);
+            if (data.success && data.student) {
+                console.log(data.duplicate ? '🔁 Already scanned today' : '✅ Attendance marked successfully');
+                showStudentModal(data.student, data);
 
                 // Update attendance table if we're on the attendance page
                 if (typeof updateAttendanceTable === 'function') {
                     updateAttendanceTable();
                 }
             } else {
-                console.error('❌ Failed to mark attendance:', data.message || 'Unknown error');
-                // Still show student info even if attendance fails
-                fetchStudentInfo(studentId);
+                console.error('❌ Scan rejected:', data.message || 'Unknown error');
+                showNotFoundModal(studentId);
             }
         })
         .catch(error => {
             console.error('❌ Error marking attendance:', error);
+            // Network is down: keep the scan so it can be replayed later
+            bufferScan({
+                student_idno: studentId,
+                date: currentDate,
+                time_in: currentTime,
+                status: 'PRESENT'
+            });
             // Still try to show student info
             fetchStudentInfo(studentId);
         });
 }
 
+// Rate limited or queue full: fail like a network error so the scan is buffered
+function checkBusy(response) {
+    if (response.status === 429 || response.status === 503) {
+        throw new Error(`Server busy (${response.status})`);
+    }
+    // The server takes requests again: replay scans buffered meanwhile
+    if (loadScanBuffer().length > 0) flushScanBuffer();
+    return response.json();
+}
+
+function sendScan(scan) {
+    fetch('/api/attendance/mark', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(scan)
+    })
+        .then(checkBusy)
+        .then(data => {
+            if (data.success) {
+                console.log('✅ Attendance marked successfully');
+                if (typeof updateAttendanceTable === 'function') {
+                    updateAttendanceTable();
+                }
+            } else {
+                console.error('❌ Failed to mark attendance:', data.message || 'Unknown error');
+            }
+        })
+        .catch(error => {
+            console.error('❌ Error marking attendance:', error);
+            bufferScan(scan);
+        });
+}
+
+// ============================================
+// OFFLINE ROSTER (IndexedDB)
+// ============================================
+
+const ROSTER_DB_NAME = 'scannerRoster';
+const ROSTER_SYNC_MS = 5 * 60 * 1000;
+let rosterDb = null;
+let isSyncingRoster = false;
+
+// Wrap an IndexedDB request in a promise
+function idbRequest(request) {
+    return new Promise((resolve, reject) => {
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function openRosterDb() {
+    if (!window.indexedDB) return Promise.resolve(null);
+    if (!rosterDb) {
+        rosterDb = new Promise(resolve => {
+            const request = indexedDB.open(ROSTER_DB_NAME, 1);
+            request.onupgradeneeded = () => {
+                request.result.createObjectStore('students', { keyPath: 'idno' });
+                request.result.createObjectStore('meta');
+            };
+            request.onsuccess = () => resolve(request.result);
+            // Without IndexedDB every scan is looked up online
+            request.onerror = () => resolve(null);
+        });
+    }
+    return rosterDb;
+}
+
+async function getRosterStudent(studentId) {
+    try {
+        const db = await openRosterDb();
+        if (!db) return null;
+        const store = db.transaction('students').objectStore('students');
+        return (await idbRequest(store.get(String(studentId)))) || null;
+    } catch (error) {
+        console.warn('⚠️ Roster lookup failed:', error);
+        return null;
+    }
+}
+
+// Apply one /api/roster page and its version in a single transaction
+function applyRosterPage(db, data, reset) {
+    return new Promise((resolve, reject) => {
+        const tx = db.transaction(['students', 'meta'], 'readwrite');
+        const students = tx.objectStore('students');
+        if (reset) students.clear();
+
+        data.students.forEach(row => {
+            const student = {};
+            data.fields.forEach((field, index) => { student[field] = row[index]; });
+            student.image = student.thumb;
+            students.put(student);
+        });
+        data.deleted.forEach(idno => students.delete(idno));
+        tx.objectStore('meta').put(data.version, 'version');
+
+        tx.oncomplete = resolve;
+        tx.onerror = () => reject(tx.error);
+    });
+}
+
+async function syncRoster() {
+    if (isSyncingRoster) return;
+    isSyncingRoster = true;
+
+    try {
+        const db = await openRosterDb();
+        if (!db) return;
+
+        let version = (await idbRequest(db.transaction('meta').objectStore('meta').get('version'))) || 0;
+        let more = true;
+        while (more) {
+            const response = await fetch(`/api/roster?since=${version}`);
+            const data = await response.json();
+            if (!data.success) {
+                // Not a registered kiosk (or sync failed): scans are looked up online
+                console.warn('⚠️ Roster not synced:', data.message);
+                return;
+            }
+
+            // The server is behind our copy (database restored): start over
+            if (data.version < version) {
+                version = 0;
+                continue;
+            }
+            await applyRosterPage(db, data, data.full);
+            version = data.version;
+            more = data.more;
+        }
+        console.log('📇 Roster synced to version', version);
+    } catch (error) {
+        console.warn('⚠️ Roster sync deferred:', error);
+    } finally {
+        isSyncingRoster = false;
+    }
+}
+
+window.addEventListener('online', syncRoster);
+document.addEventListener('DOMContentLoaded', syncRoster);
+setInterval(syncRoster, ROSTER_SYNC_MS);
+
+// ============================================
+// OFFLINE SCAN BUFFER
+// ============================================
+
+const SCAN_BUFFER_KEY = 'pendingScans';
+// Scans the server refused as invalid: kept for inspection, never replayed
+const SCAN_REJECTED_KEY = 'rejectedScans';
+const SCAN_BATCH_SIZE = 500;
+// Replay is retried on a timer: flaky Wi-Fi fails requests without ever
+// firing 'offline'/'online'. The delay doubles after each failure.
+const SCAN_RETRY_MS = 5000;
+const SCAN_RETRY_MAX_MS = 5 * 60 * 1000;
+let isFlushingScans = false;
+let scanRetryDelay = SCAN_RETRY_MS;
+let scanRetryTimer = null;
+
+function loadScanBuffer() {
+    try {
+        return JSON.parse(localStorage.getItem(SCAN_BUFFER_KEY)) || [];
+    } catch (error) {
+        return [];
+    }
+}
+
+function rejectScans(scans, status) {
+    let rejected;
+    try {
+        rejected = JSON.parse(localStorage.getItem(SCAN_REJECTED_KEY)) || [];
+    } catch (error) {
+        rejected = [];
+    }
+    rejected.push(...scans.map(scan => ({ ...scan, rejected_status: status })));
+    localStorage.setItem(SCAN_REJECTED_KEY, JSON.stringify(rejected));
+    console.error('❌ Server rejected', scans.length, 'buffered scans; moved to', SCAN_REJECTED_KEY);
+}
+
+function bufferScan(scan) {
+    const buffer = loadScanBuffer();
+    scan.idempotency_key = (window.crypto && crypto.randomUUID)
+        ? crypto.randomUUID()
+        : `${scan.student_idno}-${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    buffer.push(scan);
+    localStorage.setItem(SCAN_BUFFER_KEY, JSON.stringify(buffer));
+    console.log('💾 Scan buffered for replay. Pending:', buffer.length);
+    scheduleScanReplay();
+}
+
+function scheduleScanReplay() {
+    if (scanRetryTimer || loadScanBuffer().length === 0) return;
+    scanRetryTimer = setTimeout(() => {
+        scanRetryTimer = null;
+        flushScanBuffer();
+    }, scanRetryDelay);
+}
+
+async function flushScanBuffer() {
+    if (isFlushingScans) return;
+    isFlushingScans = true;
+
+    try {
+        let buffer = loadScanBuffer();
+        while (buffer.length > 0) {
+            const batch = buffer.slice(0, SCAN_BATCH_SIZE);
+            const response = await fetch('/api/attendance/mark_batch', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({ scans: batch })
+            });
+
+            // Refused as invalid (not rate limited): it would fail again
+            // on every retry, so it leaves the buffer
+            if (response.status >= 400 && response.status < 500 && response.status !== 429) {
+                rejectScans(batch, response.status);
+                buffer = loadScanBuffer().slice(batch.length);
+                localStorage.setItem(SCAN_BUFFER_KEY, JSON.stringify(buffer));
+                continue;
+            }
+
+            if (!response.ok) {
+                console.error('❌ Scan replay failed with status', response.status);
+                // Rate limited: wait at least as long as the server asks
+                const retryAfter = parseInt(response.headers.get('Retry-After'), 10);
+                if (retryAfter > 0) {
+                    scanRetryDelay = Math.max(scanRetryDelay, retryAfter * 1000);
+                }
+                break;
+            }
+
+            // Applied, duplicate and invalid scans are all done with
+            buffer = loadScanBuffer().slice(batch.length);
+            localStorage.setItem(SCAN_BUFFER_KEY, JSON.stringify(buffer));
+            console.log('✅ Replayed', batch.length, 'buffered scans. Pending:', buffer.length);
+        }
+
+        if (typeof updateAttendanceTable === 'function') {
+            updateAttendanceTable();
+        }
+    } catch (error) {
+        console.warn('⚠️ Scan replay deferred, still offline:', error);
+    } finally {
+        isFlushingScans = false;
+        if (loadScanBuffer().length > 0) {
+            scanRetryDelay = Math.min(scanRetryDelay * 2, SCAN_RETRY_MAX_MS);
+            scheduleScanReplay();
+        } else {
+            scanRetryDelay = SCAN_RETRY_MS;
+        }
+    }
+}
+
+window.addEventListener('online', flushScanBuffer);
+document.addEventListener('DOMContentLoaded', flushScanBuffer);
+
 // ============================================
 // UTILITY FUNCTIONS
 // ============================================
@@ -527,6 +816,9 @@ window.qrScanner = {
     stopScanner,
     fetchStudentInfo,
     markAttendance,
+    flushScanBuffer,
+    syncRoster,
+    pendingScans: () => loadScanBuffer().length,
     isScanning: () => isScanning,
     activeModals: () => activeModals.length
 };
@@ -2,43 +2,95 @@
 // STUDENT_MNGT.HTML - ENHANCED LIST MANAGEMENT
 // ============================================
 
-// Global variables for sorting and filtering
+// Global variables for sorting, filtering and paging
+// Students are fetched page by page from /api/students (keyset pagination)
 let studentsData = [];
 let currentSortColumn = 'idno';
 let currentSortOrder = 'asc';
 let searchQuery = '';
+let nextCursor = null;
+let totalStudents = 0;
+let pageRequest = 0;
+let searchTimer = null;
+
+const PAGE_SIZE = 50;
+const SEARCH_LIMIT = 100;
+
+// API sort keys for the table columns
+const SORT_KEYS = {
+    'idno': 'idno',
+    'lastname': 'Lastname',
+    'firstname': 'Firstname',
+    'course': 'course',
+    'level': 'level'
+};
 
 // Initialize student list management
 function initializeStudentList() {
-    // Get all student rows from the table
     const tbody = document.getElementById('studentTableBody');
     if (!tbody) return;
 
-    const rows = tbody.querySelectorAll('tr');
-    studentsData = [];
-
-    rows.forEach(row => {
-        const cells = row.cells;
-        if (cells.length > 1) { // Skip "no students" message row
-            studentsData.push({
-                idno: cells[0].textContent.trim(),
-                lastname: cells[1].textContent.trim(),
-                firstname: cells[2].textContent.trim(),
-                course: cells[3].textContent.trim(),
-                level: cells[4].textContent.trim(),
-                element: row.cloneNode(true) // Clone to preserve original
-            });
-        }
-    });
-
     // Add sort functionality to headers
     addSortListeners();
 
     // Add search functionality
     addSearchListener();
 
-    // Initial render
-    renderStudentList();
+    // Load the first page
+    fetchStudents(true);
+}
+
+// Fetch a page of students; reset starts again from the first page.
+// With a search query the ranked full-text results are shown instead.
+async function fetchStudents(reset) {
+    let url;
+    if (searchQuery) {
+        const params = new URLSearchParams({ q: searchQuery, limit: SEARCH_LIMIT });
+        url = `/api/students/search?${params}`;
+    } else {
+        const params = new URLSearchParams({
+            sort: SORT_KEYS[currentSortColumn],
+            order: currentSortOrder,
+            limit: PAGE_SIZE
+        });
+        if (!reset && nextCursor) params.set('cursor', nextCursor);
+        url = `/api/students?${params}`;
+    }
+
+    // Ignore responses to requests that a newer search or sort replaced
+    const request = ++pageRequest;
+
+    try {
+        const response = await fetch(url);
+        const data = await response.json();
+        if (request !== pageRequest) return;
+
+        if (!data.success) {
+            console.error('❌ Failed to load students:', data.message);
+            return;
+        }
+
+        if (searchQuery) {
+            studentsData = data.students;
+            totalStudents = data.students.length;
+            nextCursor = null;
+        } else {
+            if (reset) {
+                studentsData = [];
+                totalStudents = data.total;
+            }
+            studentsData = studentsData.concat(data.students);
+            nextCursor = data.next_cursor;
+        }
+        renderStudentList();
+    } catch (error) {
+        console.error('❌ Error loading students:', error);
+    }
+}
+
+// Load the next page
+function loadMoreStudents() {
+    if (nextCursor) fetchStudents(false);
 }
 
 // Add click listeners to table headers for sorting
@@ -69,13 +121,16 @@ function addSortListeners() {
     });
 }
 
-// Add search input listener
+// Add search input listener (debounced, searched on the server)
 function addSearchListener() {
     const searchInput = document.getElementById('studentSearch');
     if (searchInput) {
         searchInput.addEventListener('input', (e) => {
-            searchQuery = e.target.value.toLowerCase().trim();
-            renderStudentList();
+            clearTimeout(searchTimer);
+            searchTimer = setTimeout(() => {
+                searchQuery = e.target.value.trim();
+                fetchStudents(true);
+            }, 250);
         });
     }
 }
@@ -91,8 +146,8 @@ function sortStudents(column) {
         currentSortOrder = 'asc';
     }
 
-    renderStudentList();
     updateSortIcons();
+    fetchStudents(true);
 }
 
 // Update sort icons in headers
@@ -126,45 +181,71 @@ function updateSortIcons() {
     }
 }
 
-// Filter and sort students, then render
-function renderStudentList() {
-    const tbody = document.getElementById('studentTableBody');
-    if (!tbody) return;
-
-    // Filter students based on search query
-    let filteredStudents = studentsData.filter(student => {
-        if (!searchQuery) return true;
-
-        return student.idno.toLowerCase().includes(searchQuery) ||
-            student.lastname.toLowerCase().includes(searchQuery) ||
-            student.firstname.toLowerCase().includes(searchQuery) ||
-            student.course.toLowerCase().includes(searchQuery) ||
-            student.level.toLowerCase().includes(searchQuery);
+const CELL_CLASS = 'px-3 sm:px-6 md:px-8 py-3 sm:py-5 md:py-6 text-xs sm:text-base md:text-lg lg:text-xl';
+
+const VIEW_ICON = `<svg class="w-4 h-4 sm:w-5 sm:h-5 md:w-6 md:h-6 inline" fill="none" stroke="currentColor" viewBox="0 0 24 24">
+    <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M15 12a3 3 0 11-6 0 3 3 0 016 0z" />
+    <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M2.458 12C3.732 7.943 7.523 5 12 5c4.478 0 8.268 2.943 9.542 7-1.274 4.057-5.064 7-9.542 7-4.477 0-8.268-2.943-9.542-7z" />
+</svg>`;
+
+const DELETE_ICON = `<svg class="w-4 h-4 sm:w-5 sm:h-5 md:w-6 md:h-6 inline" fill="none" stroke="currentColor" viewBox="0 0 24 24">
+    <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2" d="M19 7l-.867 12.142A2 2 0 0116.138 21H7.862a2 2 0 01-1.995-1.858L5 7m5 4v6m4-6v6m1-10V4a1 1 0 00-1-1h-4a1 1 0 00-1 1v3M4 7h16" />
+</svg>`;
+
+// Build one table row for a student
+function createStudentRow(student) {
+    const row = document.createElement('tr');
+    row.className = 'hover:bg-gray-50 transition';
+
+    const cells = [
+        [student.idno, 'text-blue-600 font-bold'],
+        [student.Lastname, 'text-gray-800 font-medium'],
+        [student.Firstname, 'text-gray-800 font-medium'],
+        [student.course, 'text-gray-800'],
+        [student.level, 'text-gray-800']
+    ];
+    cells.forEach(([value, extraClass]) => {
+        const td = document.createElement('td');
+        td.className = `${CELL_CLASS} ${extraClass}`;
+        td.textContent = value ?? '';
+        row.appendChild(td);
     });
 
-    // Sort filtered students
-    filteredStudents.sort((a, b) => {
-        let aVal = a[currentSortColumn].toLowerCase();
-        let bVal = b[currentSortColumn].toLowerCase();
-
-        // Special handling for level (extract number)
-        if (currentSortColumn === 'level') {
-            aVal = parseInt(aVal) || 0;
-            bVal = parseInt(bVal) || 0;
-        }
+    const actionCell = document.createElement('td');
+    actionCell.className = 'px-3 sm:px-6 md:px-8 py-3 sm:py-5 md:py-6';
+    const actions = document.createElement('div');
+    actions.className = 'flex justify-center gap-2 sm:gap-3';
+
+    const viewBtn = document.createElement('button');
+    viewBtn.className = 'bg-cyan-300 hover:bg-cyan-400 text-black px-2 sm:px-3 md:px-4 py-1 sm:py-2 md:py-3 rounded text-xs sm:text-sm md:text-base lg:text-lg font-bold transition';
+    viewBtn.title = 'View Student';
+    viewBtn.innerHTML = VIEW_ICON;
+    viewBtn.addEventListener('click', () => viewStudentInForm(student.idno));
+
+    const deleteBtn = document.createElement('button');
+    deleteBtn.className = 'bg-red-500 hover:bg-red-600 text-white px-2 sm:px-3 md:px-4 py-1 sm:py-2 md:py-3 rounded text-xs sm:text-sm md:text-base lg:text-lg font-bold transition';
+    deleteBtn.title = 'Delete Student';
+    deleteBtn.innerHTML = DELETE_ICON;
+    deleteBtn.addEventListener('click', () =>
+        deleteStudent(student.idno, `${student.Firstname} ${student.Lastname}`));
+
+    actions.appendChild(viewBtn);
+    actions.appendChild(deleteBtn);
+    actionCell.appendChild(actions);
+    row.appendChild(actionCell);
+
+    return row;
+}
 
-        if (currentSortOrder === 'asc') {
-            return aVal > bVal ? 1 : -1;
-        } else {
-            return aVal < bVal ? 1 : -1;
-        }
-    });
+// Render the loaded pages
+function renderStudentList() {
+    const tbody = document.getElementById('studentTableBody');
+    if (!tbody) return;
 
     // Clear tbody
     tbody.innerHTML = '';
 
-    // Render filtered and sorted students
-    if (filteredStudents.length === 0) {
+    if (studentsData.length === 0) {
         tbody.innerHTML = `
             <tr>
                 <td colspan="6" class="px-4 py-8 text-center text-gray-500">
@@ -173,65 +254,28 @@ function renderStudentList() {
             </tr>
         `;
     } else {
-        filteredStudents.forEach(student => {
-            const row = student.element.cloneNode(true);
-            tbody.appendChild(row);
-        });
+        const fragment = document.createDocumentFragment();
+        studentsData.forEach(student => fragment.appendChild(createStudentRow(student)));
+        tbody.appendChild(fragment);
+    }
 
-        // Re-attach event listeners to cloned elements
-        reattachEventListeners();
+    const loadMoreBtn = document.getElementById('loadMoreBtn');
+    if (loadMoreBtn) {
+        loadMoreBtn.classList.toggle('hidden', !nextCursor);
     }
 
     // Update result count
-    updateResultCount(filteredStudents.length, studentsData.length);
-}
-
-// Re-attach event listeners after rendering
-function reattachEventListeners() {
-    const tbody = document.getElementById('studentTableBody');
-    if (!tbody) return;
-
-    // Re-attach view button listeners
-    tbody.querySelectorAll('button[onclick*="viewStudentInForm"]').forEach(btn => {
-        const onclick = btn.getAttribute('onclick');
-        if (onclick) {
-            const match = onclick.match(/viewStudentInForm\('([^']+)'\)/);
-            if (match) {
-                const studentId = match[1];
-                btn.onclick = function (e) {
-                    e.preventDefault();
-                    viewStudentInForm(studentId);
-                };
-            }
-        }
-    });
-
-    // Re-attach delete button listeners
-    tbody.querySelectorAll('button[onclick*="deleteStudent"]').forEach(btn => {
-        const onclick = btn.getAttribute('onclick');
-        if (onclick) {
-            const match = onclick.match(/deleteStudent\('([^']+)',\s*'([^']+)'\)/);
-            if (match) {
-                const studentId = match[1];
-                const studentName = match[2];
-                btn.onclick = function (e) {
-                    e.preventDefault();
-                    deleteStudent(studentId, studentName);
-                };
-            }
-        }
-    });
+    updateResultCount(studentsData.length, totalStudents);
 }
 
 // Update result count display
-function updateResultCount(filtered, total) {
+function updateResultCount(loaded, total) {
     const countElement = document.getElementById('resultCount');
     if (countElement) {
-        if (searchQuery) {
-            countElement.textContent = `Showing ${filtered} of ${total} students`;
-        } else {
-            countElement.textContent = `Total: ${total} students`;
-        }
+        const noun = searchQuery ? 'matching students' : 'students';
+        countElement.textContent = loaded < total
+            ? `Showing ${loaded} of ${total} ${noun}`
+            : `Total: ${total} ${noun}`;
     }
 }
 
@@ -241,11 +285,11 @@ function clearSearch() {
     if (searchInput) {
         searchInput.value = '';
         searchQuery = '';
-        renderStudentList();
+        fetchStudents(true);
     }
 }
 
-// Export filtered students to CSV
+// Export the loaded students to CSV
 function exportFilteredStudents() {
     const tbody = document.getElementById('studentTableBody');
     if (!tbody) return;
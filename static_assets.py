@@ -0,0 +1,119 @@
+"""Fingerprints and precompressed copies of files under static/
+
+Static URLs get ?v=<content hash> (see the url_defaults hook in app.py) so
+they can be cached forever: a changed file gets a new URL. Text assets are
+precompressed by `flask --app app compress-static` into <file>.gz and, when
+the brotli package is installed, <file>.br next to the original.
+"""
+import gzip
+import hashlib
+import os
+import re
+import threading
+
+try:
+    import brotli
+except ImportError:  # brotli is optional: without it only .gz copies are made
+    brotli = None
+
+# Cache-Control max-age for fingerprinted URLs (one year)
+IMMUTABLE_MAX_AGE: int = 31536000
+# Files worth compressing; images are compressed already
+COMPRESS_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html'}
+FINGERPRINT_LENGTH: int = 12
+
+# Photos stored as images/<aa>/<sha256>... are named by their content
+CONTENT_ADDRESSED = re.compile(r'^images/[0-9a-f]{2}/[0-9a-f]{64}')
+
+_lock = threading.Lock()
+_fingerprints = {}
+
+
+def fingerprint(static_folder, filename):
+    """Get a short content hash of a static file (None if it does not exist)
+
+    Hashes are cached per file and recomputed when its size or mtime
+    changes, so a url_for() call normally costs one stat().
+    """
+    path = os.path.join(static_folder, filename)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    with _lock:
+        cached = _fingerprints.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    value = digest.hexdigest()[:FINGERPRINT_LENGTH]
+    with _lock:
+        _fingerprints[path] = (key, value)
+    return value
+
+
+def is_immutable(static_folder, filename, version):
+    """True if the requested URL names this exact content"""
+    if CONTENT_ADDRESSED.match(filename):
+        return True
+    return bool(version) and version == fingerprint(static_folder, filename)
+
+
+def precompressed(static_folder, filename, accepted):
+    """Pick a precompressed copy the client accepts: (filename, encoding) or None
+
+    A copy older than its source is ignored, so a stale .gz is never sent.
+    """
+    path = os.path.join(static_folder, filename)
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if encoding not in accepted:
+            continue
+        try:
+            if os.stat(path + suffix).st_mtime_ns >= os.stat(path).st_mtime_ns:
+                return filename + suffix, encoding
+        except OSError:
+            continue
+    return None
+
+
+def compress_all(static_folder, force=False):
+    """Write .gz (and .br) copies of every compressible static file
+
+    Copies that are up to date are skipped unless force is set. Returns
+    a list of (filename, original bytes, gzip bytes, brotli bytes or None).
+    """
+    report = []
+    for folder, _, files in os.walk(static_folder):
+        for name in files:
+            if os.path.splitext(name)[1] not in COMPRESS_EXTENSIONS:
+                continue
+            path = os.path.join(folder, name)
+            data = None
+            sizes = []
+            targets = [('.gz', lambda raw: gzip.compress(raw, 9, mtime=0))]
+            if brotli is not None:
+                targets.append(('.br', lambda raw: brotli.compress(raw, quality=11)))
+
+            for suffix, compress in targets:
+                target = path + suffix
+                if (not force and os.path.exists(target)
+                        and os.stat(target).st_mtime_ns >= os.stat(path).st_mtime_ns):
+                    sizes.append(os.path.getsize(target))
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                with open(target + '.part', 'wb') as f:
+                    f.write(compress(data))
+                os.replace(target + '.part', target)
+                sizes.append(os.path.getsize(target))
+
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            report.append((filename, os.path.getsize(path), sizes[0],
+                           sizes[1] if len(sizes) > 1 else None))
+    return report
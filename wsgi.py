@@ -0,0 +1,110 @@
+"""Production entry point: serve the app with waitress or gunicorn
+
+    SECRET_KEY=... python wsgi.py [--server waitress|gunicorn]
+                                  [--host HOST] [--port PORT]
+                                  [--workers N] [--threads N]
+
+Defaults come from the environment variables below. The database is
+created or migrated once, by main(), before the server starts and gunicorn
+forks its workers. Any other WSGI server can load wsgi:app, which never
+migrates: run `flask --app app migrate` first, or requests get 503.
+
+Attendance push events, lookup caches and rate limits live in process
+memory. With more than one gunicorn worker, a live attendance update only
+reaches pages connected to the worker that handled the scan. Keep
+WEB_WORKERS at 1 and add threads unless that is acceptable. Every open
+attendance stream holds a thread, so at most MAX_STREAMS (by default half
+of WEB_THREADS) are accepted per process. Pages beyond that poll instead,
+and the rest of the threads stay free for scans.
+"""
+import argparse
+import os
+import sys
+
+HOST: str = os.environ.get('HOST', '0.0.0.0')
+PORT: int = int(os.environ.get('PORT', 8000))
+WORKERS: int = int(os.environ.get('WEB_WORKERS', 1))       # processes (gunicorn only)
+THREADS: int = int(os.environ.get('WEB_THREADS', 32))      # request threads per process
+MAX_STREAMS: int = int(os.environ.get('MAX_STREAMS', 0))   # open attendance streams (0: THREADS // 2)
+# Reverse proxies in front of the app whose X-Forwarded-For / -Proto are
+# trusted; without this every client shares the proxy's rate limit bucket
+TRUSTED_PROXIES: int = int(os.environ.get('TRUSTED_PROXIES', 0))
+
+if not os.environ.get('SECRET_KEY'):
+    raise RuntimeError("SECRET_KEY must be set: sessions would not survive a restart "
+                       "or be shared between workers")
+
+from app import app  # noqa: E402
+import attendance_events  # noqa: E402
+import db_helper  # noqa: E402
+
+if TRUSTED_PROXIES:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXIES, x_proto=TRUSTED_PROXIES)
+
+
+def limit_streams(threads, max_streams=0):
+    """Cap open attendance streams so they never take every request thread"""
+    attendance_events.MAX_CLIENTS = max_streams or max(1, threads // 2)
+    if attendance_events.MAX_CLIENTS >= threads:
+        print(f"Warning: {attendance_events.MAX_CLIENTS} streams can hold all "
+              f"{threads} threads and stall scans")
+
+
+# Servers loading wsgi:app directly run with the environment's settings
+limit_streams(THREADS, MAX_STREAMS)
+
+
+def serve_waitress(host, port, threads):
+    """One process, `threads` request threads"""
+    try:
+        from waitress import serve
+    except ImportError:
+        sys.exit("waitress is not installed (pip install waitress)")
+    serve(app, host=host, port=port, threads=threads)
+
+
+def serve_gunicorn(host, port, workers, threads):
+    """`workers` processes with `threads` threads each (gthread workers)"""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        sys.exit("gunicorn is not installed (pip install gunicorn)")
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{host}:{port}")
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+
+        def load(self):
+            return app
+
+    Server().run()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--server', choices=('waitress', 'gunicorn'), default='waitress')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=WORKERS, help='gunicorn processes')
+    parser.add_argument('--threads', type=int, default=THREADS, help='threads per process')
+    parser.add_argument('--max-streams', type=int, default=MAX_STREAMS,
+                        help='open attendance streams per process (default: half the threads)')
+    args = parser.parse_args()
+    limit_streams(args.threads, args.max_streams)
+    db_helper.ensure_db()
+
+    print(f"Serving on {args.host}:{args.port} with {args.server}: "
+          f"{args.workers if args.server == 'gunicorn' else 1} process(es) "
+          f"x {args.threads} threads, up to {attendance_events.MAX_CLIENTS} attendance streams")
+    if args.server == 'gunicorn':
+        serve_gunicorn(args.host, args.port, args.workers, args.threads)
+    else:
+        serve_waitress(args.host, args.port, args.threads)
+
+
+if __name__ == '__main__':
+    main()